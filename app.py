@@ -1,93 +1,485 @@
-from flask import Flask, render_template, jsonify, request
-from database import FarmDatabase
-from chart_generator import ChartGenerator
+from flask import (
+    Blueprint, Flask, current_app, render_template, jsonify, request, Response,
+    stream_with_context
+)
+from cache import cache, DEFAULT_TTLS, DATA_FAMILIES
+from replica import replica
+from precompute import precomputer
+import metrics
+from metrics import span
+from http_cache import conditional, compress_response
+from parallel import run_parallel
+import os
+import time
 import logging
-from datetime import datetime, timedelta
+import math
+import threading
+from datetime import datetime
+
+# pandas, Plotly e mysql-connector (database, chart_generator, export, ...) si importano
+# dentro le funzioni che li usano: un worker serve "/" senza pagarne il caricamento.
+# APP_PRELOAD=1 li carica invece subito, insieme a pool e grafici: da usare con
+# "gunicorn --preload" così il lavoro si fa una volta nel master prima del fork.
+APP_PRELOAD = os.getenv('APP_PRELOAD', '0') == '1'
+# /api/stream tiene occupato un thread del worker per tutta la durata della connessione:
+# da abilitare solo con worker a thread o asincroni (es. gunicorn --threads 32, -k gevent
+# o la modalità ASGI). Con i worker sync di default la dashboard usa il polling.
+LIVE_UPDATES_ENABLED = os.getenv('LIVE_UPDATES_ENABLED', '0') == '1'
 
-app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
+bp = Blueprint('dashboard', __name__)
+
+_background_pid = None
+_background_lock = threading.Lock()
 
-@app.route('/')
+@bp.before_app_request
+def start_background():
+    """Avvia sync della replica e precalcolo, una volta per processo (anche dopo un fork)"""
+    global _background_pid
+    pid = os.getpid()
+    if _background_pid == pid:
+        return
+    with _background_lock:
+        if _background_pid != pid:
+            replica.start()
+            precomputer.start()
+            _background_pid = pid
+
+@bp.route('/')
 def dashboard():
     return render_template('dashboard.html')
 
-@app.route('/api/charts')
+_seen_version = None
+_version_lock = threading.Lock()
+
+def data_version():
+    """Token di versione dei dati: ultima data in Stato e Storico
+
+    Quando il token cambia le famiglie di dati in cache vengono scartate, così l'ETag
+    della nuova versione non viene mai associato a un corpo calcolato prima.
+    """
+    global _seen_version
+    from database import FarmDatabase
+    watermarks = FarmDatabase().get_latest_timestamps()
+    if not watermarks:
+        return None
+    version = f"{watermarks.get('stato')}|{watermarks.get('storico')}"
+    with _version_lock:
+        if version != _seen_version:
+            for family in DATA_FAMILIES:
+                cache.invalidate(family)
+            _seen_version = version
+    return version
+
+# Grafici di /api/charts senza ?assets= (chart_generator.render_charts li disegna)
+CHART_NAMES = ('humidity', 'resources', 'temperature')
+
+def parse_chart_selection(assets):
+    """Grafici e serie richiesti da ?assets= (nomi grafico o chiavi parametro_asset)"""
+    from chart_generator import ChartGenerator
+    if not assets:
+        return list(CHART_NAMES), None
+    tokens = [token.strip() for token in assets.split(',') if token.strip()]
+    charts = []
+    series = []
+    for name, chart_series in ChartGenerator.CHART_SERIES.items():
+        for key in chart_series:
+            if name in tokens or f"{key[0]}_{key[1]}" in tokens:
+                series.append(key)
+                if name not in charts:
+                    charts.append(name)
+    if not charts:
+        raise ValueError(f"Unknown assets: {assets}")
+    return charts, tuple(series)
+
+def parse_datetime_arg(name, args=None):
+    args = request.args if args is None else args
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' datetime: {value}")
+    if parsed.tzinfo is not None:
+        # Le date nel DB sono in ora locale senza fuso: ...Z o +02:00 si convertono
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+# Oltre questo limite timedelta(hours=...) va in overflow: nessuno storico è così lungo
+MAX_HOURS_BACK = 24 * 365 * 100
+
+def parse_number_arg(args, name, kind, default=None, minimum=0, maximum=None):
+    """Numero non negativo dal parametro name: default se assente, ValueError se non valido"""
+    value = args.get(name)
+    if not value:
+        return default
+    try:
+        number = kind(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' number: {value}")
+    if not math.isfinite(number) or number < minimum:
+        raise ValueError(f"Invalid '{name}': {value} (must be >= {minimum})")
+    if maximum is not None and number > maximum:
+        raise ValueError(f"Invalid '{name}': {value} (must be <= {maximum})")
+    return number
+
+def check_range(start, end):
+    if start is not None and end is not None and start >= end:
+        raise ValueError(f"Invalid range: 'from' ({start}) must be before 'to' ({end})")
+
+def parse_chart_args(args):
+    """Opzioni di /api/charts dai parametri della richiesta (ValueError se non valide)"""
+    from chart_encoding import ENCODINGS
+    charts, series = parse_chart_selection(args.get('assets'))
+    encoding = args.get('encoding', 'json')
+    start = parse_datetime_arg('from', args)
+    end = parse_datetime_arg('to', args)
+    check_range(start, end or (datetime.now() if start is not None else None))
+    return {
+        'charts': charts,
+        'series': series,
+        'start': start,
+        'end': end,
+        'hours_back': parse_number_arg(args, 'hours_back', float, 24, maximum=MAX_HOURS_BACK),
+        # max_points=0 disattiva il downsampling lato server
+        'max_points': parse_number_arg(args, 'max_points', int),
+        # data_only=1 restituisce solo le tracce: il layout resta quello già disegnato
+        'data_only': args.get('data_only', '0') == '1',
+        'encoding': encoding if encoding in ENCODINGS else 'json',
+    }
+
+def chart_data(hours_back=24, start=None, end=None, series=None, max_points=None, **_):
+    """Dati dei sensori per i grafici (None se non ci sono dati); accetta le opzioni di
+    parse_chart_args"""
+    from database import FarmDatabase
+    df = FarmDatabase().get_sensor_data(
+        hours_back=hours_back, max_points=max_points,
+        start=start, end=end, series=series
+    )
+    return None if df.empty else df
+
+def build_charts(charts, hours_back=24, start=None, end=None, series=None,
+                 max_points=None, data_only=False, encoding='json'):
+    """Genera il corpo JSON dei grafici richiesti (None se non ci sono dati)"""
+    from chart_generator import render_charts
+    df = chart_data(hours_back, start, end, series, max_points)
+    if df is None:
+        return None
+    return render_charts(
+        df, charts, max_points=max_points, data_only=data_only, encoding=encoding
+    )
+
+def charts_cache_key(options):
+    return ('charts', tuple(options['charts']), options['series'], options['hours_back'],
+            options['start'], options['end'], options['max_points'], options['data_only'],
+            options['encoding'])
+
+def charts_body(options):
+    """Corpo di /api/charts per le opzioni di parse_chart_args, calcolato una volta per chiave"""
+    return cache.get_or_compute(
+        charts_cache_key(options), lambda: build_charts(**options),
+        DEFAULT_TTLS['charts'], cache_if=lambda value: value is not None
+    )
+
+def default_chart_view(args, options):
+    """Nome della vista precalcolata che risponde alla richiesta, se è quella di default"""
+    view = (options['encoding'], options['data_only'])
+    if set(args) <= {'encoding', 'data_only'} and view in PRECOMPUTED_CHARTS:
+        return precomputed_chart_name(*view)
+    return None
+
+@bp.route('/api/charts')
+@conditional(data_version)
 def get_charts():
+    """Endpoint grafici: ?from=&to= o ?hours_back=, ?assets=, ?max_points="""
+    try:
+        options = parse_chart_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     try:
-        db = FarmDatabase()
-        df = db.get_sensor_data(hours_back=24)
+        # Vista di default: la risposta è già pronta dal worker in background
+        view = default_chart_view(request.args, options)
+        if view is not None:
+            response = precomputed_response(view)
+            if response is not None:
+                return response
+        charts = charts_body(options)
         
-        if df.empty:
+        if charts is None:
             return jsonify({'error': 'No data available'})
         
-        chart_gen = ChartGenerator(df)
-        
-        charts = {
-            'humidity': chart_gen.create_humidity_chart(),
-            'resources': chart_gen.create_resources_chart(),
-            'temperature': chart_gen.create_temperature_chart()
-        }
-        
-        return jsonify(charts)
+        return Response(charts, mimetype='application/json')
         
     except Exception as e:
         logging.error(f"Error generating charts: {e}")
         return jsonify({'error': str(e)})
 
-@app.route('/api/kpis')
+def build_kpis():
+    from database import FarmDatabase
+    from kpi_rules import kpi_engine
+    db = FarmDatabase()
+    if not kpi_engine.needs_rates:
+        # Nessuna regola sulle variazioni orarie: basta lo snapshot di Stato
+        snapshot = db.get_stato_snapshot()
+        return kpi_engine.summary(
+            snapshot.get('sensors', {}), version=data_version(),
+            columns=snapshot.get('columns')
+        )
+    
+    from chart_generator import ChartGenerator
+    results = run_parallel({
+        'snapshot': db.get_stato_snapshot,
+        'sensor_data': lambda: db.get_sensor_data(hours_back=1),
+    }, label='/api/kpis')
+    
+    chart_gen = ChartGenerator(results['sensor_data'])
+    
+    return chart_gen.create_dashboard_summary(
+        results['snapshot'].get('sensors', {}), version=data_version(),
+        columns=results['snapshot'].get('columns')
+    )
+
+def build_system_status():
+    from database import FarmDatabase
+    db = FarmDatabase()
+    results = run_parallel({
+        'snapshot': db.get_stato_snapshot,
+        'system_statistics': db.get_system_statistics,
+    }, label='/api/system-status')
+    
+    return {
+        'status': results['snapshot'].get('systems', {}),
+        'statistics': results['system_statistics']
+    }
+
+def build_latest_data():
+    from database import FarmDatabase
+    db = FarmDatabase()
+    results = run_parallel({
+        'snapshot': db.get_stato_snapshot,
+        'system_statistics': db.get_system_statistics,
+    }, label='/api/latest-data')
+    
+    return {
+        'sensors': results['snapshot'].get('sensors', {}),
+        'systems': {
+            'status': results['snapshot'].get('systems', {}),
+            'statistics': results['system_statistics']
+        }
+    }
+
+def encode_payload(payload):
+    with span('json_encode'):
+        return current_app.json.dumps(payload)
+
+def json_response(payload):
+    with span('json_encode'):
+        return jsonify(payload)
+
+def precomputed_response(name):
+    """Risposta già calcolata dal worker in background, se aggiornata"""
+    body = precomputer.get(name, data_version())
+    if body is None:
+        return None
+    return Response(body, mimetype='application/json')
+
+@bp.route('/api/kpis')
+@conditional(data_version)
 def get_kpis():
+    response = precomputed_response('kpis')
+    if response is not None:
+        return response
     try:
-        db = FarmDatabase()
-        latest_data = db.get_latest_values()
-        
-        df = db.get_sensor_data(hours_back=1)
-        chart_gen = ChartGenerator(df)
-        
-        kpis = chart_gen.create_dashboard_summary(latest_data)
-        
-        return jsonify(kpis)
+        return json_response(build_kpis())
         
     except Exception as e:
         logging.error(f"Error getting KPIs: {e}")
         return jsonify({'error': str(e)})
 
-@app.route('/api/system-status')
+@bp.route('/api/system-status')
+@conditional(data_version)
 def get_system_status():
     """Endpoint per stato sistemi con statistiche avanzate"""
+    response = precomputed_response('system-status')
+    if response is not None:
+        return response
     try:
-        db = FarmDatabase()
-        system_status = db.get_system_status()
-        system_stats = db.get_system_statistics()
-        
-        return jsonify({
-            'status': system_status,
-            'statistics': system_stats
-        })
+        return json_response(build_system_status())
         
     except Exception as e:
         logging.error(f"Error getting system status: {e}")
         return jsonify({'error': str(e)})
 
-@app.route('/api/latest-data')
+@bp.route('/api/latest-data')
+@conditional(data_version)
 def get_latest_data():
     """Endpoint per tutti i dati più recenti"""
+    response = precomputed_response('latest-data')
+    if response is not None:
+        return response
     try:
-        db = FarmDatabase()
-        latest_data = db.get_latest_values()
-        system_status = db.get_system_status()
-        system_stats = db.get_system_statistics()
-        
-        return jsonify({
-            'sensors': latest_data,
-            'systems': {
-                'status': system_status,
-                'statistics': system_stats
-            }
-        })
+        return json_response(build_latest_data())
         
     except Exception as e:
         logging.error(f"Error getting latest data: {e}")
         return jsonify({'error': str(e)})
 
+# Viste calcolate in background: i grafici di default usati dalla dashboard e i KPI
+PRECOMPUTED_CHARTS = (('json', False), ('bdata', False), ('bdata', True))
+
+def precomputed_chart_name(encoding, data_only):
+    return f"charts:{encoding}:{int(data_only)}"
+
+def register_precomputed_views():
+    for encoding, data_only in PRECOMPUTED_CHARTS:
+        precomputer.register(
+            precomputed_chart_name(encoding, data_only),
+            lambda encoding=encoding, data_only=data_only: build_charts(
+                list(CHART_NAMES), data_only=data_only, encoding=encoding
+            )
+        )
+    precomputer.register('kpis', lambda: encode_payload(build_kpis()))
+    precomputer.register('system-status', lambda: encode_payload(build_system_status()))
+    precomputer.register('latest-data', lambda: encode_payload(build_latest_data()))
+    precomputer.version = data_version
+
+@bp.route('/api/stream')
+def stream_updates():
+    """Endpoint Server-Sent Events con i delta di KPI, sistemi e grafici"""
+    if not current_app.config['LIVE_UPDATES']:
+        return jsonify({'error': 'live updates disabled (LIVE_UPDATES_ENABLED=0)'}), 404
+    from live_updates import live_watcher
+    live_watcher.dumps = current_app.json.dumps
+    client = live_watcher.subscribe()
+    return Response(
+        stream_with_context(live_watcher.stream(client)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/export')
+def export_history():
+    """Esporta lo storico sensori in streaming (?from=&to=&format=&columns=&assets=)"""
+    from database import FarmDatabase
+    from export import (
+        ExportBusy, ExportUnavailable, FORMATS, export_stream, parse_columns, parse_series
+    )
+    try:
+        start = parse_datetime_arg('from')
+        if start is None:
+            raise ValueError("Missing 'from' datetime")
+        end = parse_datetime_arg('to') or datetime.now()
+        check_range(start, end)
+        fmt = request.args.get('format', 'csv')
+        stream = export_stream(
+            FarmDatabase().config, start, end, fmt,
+            parse_columns(request.args.get('columns')),
+            parse_series(request.args.get('assets'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except ExportBusy as e:
+        return jsonify({'error': str(e)}), 429
+    except ExportUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    
+    mimetype, extension = FORMATS[fmt]
+    filename = f"storico_{start:%Y%m%d%H%M}_{end:%Y%m%d%H%M}.{extension}"
+    return Response(
+        stream,
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@bp.route('/api/pool-stats')
+def get_pool_stats():
+    """Endpoint per le metriche del pool di connessioni"""
+    from db_pool import get_pool
+    return jsonify(get_pool().stats())
+
+@bp.route('/api/replica-stats')
+def get_replica_stats():
+    """Endpoint per lo stato della replica locale"""
+    return jsonify(replica.stats())
+
+@bp.route('/api/precompute-stats')
+def get_precompute_stats():
+    """Endpoint per le metriche del worker di precalcolo"""
+    return jsonify(precomputer.stats())
+
+@bp.route('/api/profiler')
+def profiler_settings():
+    """Stato del profiler a campione (si attiva solo da env con PROFILE_EVERY)"""
+    return jsonify(metrics.profiler.stats())
+
+@bp.route('/metrics')
+def get_metrics():
+    """Metriche in formato testo Prometheus"""
+    from db_pool import get_pool
+    body = (
+        metrics.registry.render()
+        + metrics.gauges('dashboard_db_pool', get_pool().stats())
+        + metrics.gauges('dashboard_cache', {'size': cache.stats()['size']})
+        + metrics.gauges('dashboard_startup', current_app.config['STARTUP'])
+    )
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@bp.route('/api/cache-stats')
+def get_cache_stats():
+    """Endpoint per i contatori hit/miss della cache"""
+    return jsonify(cache.stats())
+
+def preload():
+    """Carica i moduli pesanti, costruisce gli scheletri dei grafici e verifica il DB
+
+    Restituisce la durata di ogni fase in ms. Le connessioni aperte per la verifica
+    si chiudono subito: i socket non devono essere condivisi tra i worker dopo il fork.
+    """
+    timings = {}
+    started = time.perf_counter()
+    import database, live_updates, export  # noqa: F401
+    from chart_generator import ChartGenerator
+    timings['preload_imports_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    started = time.perf_counter()
+    ChartGenerator.warm_up()
+    timings['preload_charts_ms'] = round((time.perf_counter() - started) * 1000, 1)
+
+    from db_pool import get_pool
+    started = time.perf_counter()
+    pool = get_pool()
+    try:
+        pool.acquire().close()
+    except Exception as e:
+        logging.warning(f"Database not reachable during preload: {e}")
+    finally:
+        pool.close_all()
+    timings['preload_db_pool_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return timings
+
+def create_app(preload_modules=APP_PRELOAD, live_updates=LIVE_UPDATES_ENABLED):
+    """Crea l'app Flask; con preload_modules prepara tutto prima del fork dei worker"""
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.config['LIVE_UPDATES'] = live_updates
+    app.register_blueprint(bp)
+    # Registrato prima della compressione: gli hook after_request girano in ordine inverso
+    metrics.init_app(app)
+    app.after_request(compress_response)
+    register_precomputed_views()
+    precomputer.context = app.app_context
+    
+    # I thread in background partono alla prima richiesta di ogni processo
+    # (start_background), mai qui: con --preload questo codice gira nel master
+    startup = preload() if preload_modules else {}
+    startup['create_app_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    app.config['STARTUP'] = startup
+    logging.info(f"App created in {startup['create_app_ms']} ms (preload={preload_modules})")
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
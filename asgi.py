@@ -0,0 +1,472 @@
+"""Modalità ASGI: le API della dashboard su event loop, per molti client concorrenti
+
+/api/charts, /api/kpis, /api/system-status, /api/latest-data e /api/stream hanno lo
+stesso contratto dell'app Flask (corpi, ETag, compressione) ma nessuna richiesta
+occupa un thread mentre aspetta: le chiamate al DB passano da un executor di
+ASGI_DB_THREADS thread, i grafici si disegnano in ASGI_CHART_PROCESSES processi e
+ogni client SSE è solo una coda dell'event loop. Il resto (pagina, file statici,
+export, statistiche) lo serve l'app Flask in un thread dell'executor.
+
+Serve un server ASGI (es. pip install uvicorn).
+
+Uso: uvicorn asgi:app --host 0.0.0.0 --port 5000
+     gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import logging
+import multiprocessing
+from datetime import date
+from functools import partial
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+import metrics
+from cache import cache, DEFAULT_TTLS
+from precompute import precomputer
+from http_cache import make_etag, compress_body, MIN_COMPRESS_SIZE
+import app as dashboard
+
+ASGI_DB_THREADS = int(os.getenv('ASGI_DB_THREADS', 8))
+# 0 = i grafici si disegnano nei thread dell'executor, senza processi separati
+ASGI_CHART_PROCESSES = int(os.getenv('ASGI_CHART_PROCESSES', 2))
+
+
+class Request:
+    """Parametri e header di una richiesta HTTP ASGI"""
+
+    def __init__(self, scope):
+        self.path = scope['path']
+        self.pairs = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        # Come werkzeug: per i parametri ripetuti vale il primo
+        self.args = {}
+        for name, value in self.pairs:
+            self.args.setdefault(name, value)
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope['headers']
+        }
+
+
+class LiveBroadcast:
+    """Unico iscritto a live_watcher per l'event loop: smista i messaggi ai client SSE
+
+    Il watcher chiama put_nowait dal suo thread; la distribuzione avviene nel loop,
+    una sola volta per messaggio qualunque sia il numero di client.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.clients = set()
+
+    def put_nowait(self, message):
+        self.loop.call_soon_threadsafe(self._fan_out, message)
+
+    def _fan_out(self, message):
+        for client in list(self.clients):
+            try:
+                client.put_nowait(message)
+            except asyncio.QueueFull:
+                # Client troppo lento: lo si scollega, si riconnetterà da solo
+                logging.warning("Dropping slow live-update client")
+                self.clients.discard(client)
+
+    def subscribe(self):
+        from live_updates import live_watcher, CLIENT_QUEUE_SIZE
+        client = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        if not self.clients:
+            live_watcher.dumps = dashboard.app.json.dumps
+            live_watcher.subscribe(self)
+        self.clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        from live_updates import live_watcher
+        self.clients.discard(client)
+        if not self.clients:
+            live_watcher.unsubscribe(self)
+
+    def is_subscribed(self, client):
+        return client in self.clients
+
+    def close(self):
+        for client in list(self.clients):
+            self.unsubscribe(client)
+
+
+def wsgi_environ(scope, body):
+    """Environ WSGI equivalente a uno scope HTTP ASGI"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f"HTTP_{name}"
+        value = value.decode('latin-1')
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+class AsgiDashboard:
+    """Applicazione ASGI: API della dashboard native, il resto delegato all'app Flask"""
+
+    def __init__(self, flask_app, db_threads=ASGI_DB_THREADS,
+                 chart_processes=ASGI_CHART_PROCESSES):
+        self.flask_app = flask_app
+        # Qui lo stream è una coda dell'event loop: la pagina può sempre usarlo
+        flask_app.config['LIVE_UPDATES'] = True
+        self.dumps = flask_app.json.dumps
+        self.db_threads = db_threads
+        self.chart_processes = chart_processes
+        self.db_executor = None
+        self.chart_executor = None
+        self.broadcast = None
+        # Grafici in corso di disegno per chiave: le richieste uguali attendono lo stesso
+        self._renders = {}
+        # Stessi nomi di endpoint dell'app Flask, così le metriche restano confrontabili
+        self.routes = {
+            '/api/charts': ('dashboard.get_charts', self.charts),
+            '/api/kpis': ('dashboard.get_kpis', partial(
+                self.view, 'kpis', dashboard.build_kpis, 'KPIs')),
+            '/api/system-status': ('dashboard.get_system_status', partial(
+                self.view, 'system-status', dashboard.build_system_status, 'system status')),
+            '/api/latest-data': ('dashboard.get_latest_data', partial(
+                self.view, 'latest-data', dashboard.build_latest_data, 'latest data')),
+            '/api/asgi-stats': ('dashboard.get_asgi_stats', self.asgi_stats),
+        }
+        self._stats = {'requests': 0, 'active': 0, 'db_pending': 0, 'wsgi_requests': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            if scope['type'] == 'websocket':
+                await send({'type': 'websocket.close'})
+            return
+        self.start()
+        if scope['method'] == 'GET' and scope['path'] == '/api/stream':
+            await self.stream(receive, send)
+            return
+        route = self.routes.get(scope['path']) if scope['method'] == 'GET' else None
+        if route is None:
+            await self.call_flask(scope, receive, send)
+            return
+
+        endpoint, handler = route
+        request = Request(scope)
+        started = time.perf_counter()
+        self._stats['requests'] += 1
+        self._stats['active'] += 1
+        status, body = 500, b''
+        try:
+            status, body, headers = await handler(request)
+            await self.respond(request, send, status, body, headers)
+        finally:
+            self._stats['active'] -= 1
+            self._record(endpoint, status, body, time.perf_counter() - started)
+
+    def start(self):
+        """Crea executor, pool di processi e thread in background (una volta)"""
+        if self.db_executor is not None:
+            return
+        self.db_executor = ThreadPoolExecutor(self.db_threads, thread_name_prefix='asgi-db')
+        if self.chart_processes:
+            from chart_generator import ChartGenerator
+            # spawn: il server ha già dei thread attivi e fork non sarebbe sicuro
+            self.chart_executor = ProcessPoolExecutor(
+                self.chart_processes, mp_context=multiprocessing.get_context('spawn'),
+                initializer=ChartGenerator.warm_up
+            )
+        self.broadcast = LiveBroadcast(asyncio.get_running_loop())
+        dashboard.start_background()
+
+    async def warm_up(self):
+        """Carica i moduli pesanti fuori dall'event loop e avvia i processi dei grafici"""
+        started = time.perf_counter()
+        self.start()
+        timings = await self.run(dashboard.preload)
+        if self.chart_executor is not None:
+            # Ogni submit senza processi liberi ne avvia uno nuovo, fino al massimo
+            await asyncio.gather(*(
+                asyncio.wrap_future(self.chart_executor.submit(os.getpid))
+                for _ in range(self.chart_processes)
+            ))
+        logging.info(
+            f"ASGI app ready in {(time.perf_counter() - started) * 1000:.1f} ms {timings}"
+        )
+
+    def shutdown(self):
+        if self.broadcast is not None:
+            self.broadcast.close()
+        if self.chart_executor is not None:
+            self.chart_executor.shutdown(wait=False, cancel_futures=True)
+        if self.db_executor is not None:
+            self.db_executor.shutdown(wait=False, cancel_futures=True)
+        self.db_executor = self.chart_executor = self.broadcast = None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.warm_up()
+                except Exception as e:
+                    logging.error(f"ASGI startup failed: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run(self, func, *args):
+        """Esegue una funzione bloccante (DB, pandas) nell'executor limitato"""
+        self._stats['db_pending'] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.db_executor, partial(func, *args)
+            )
+        finally:
+            self._stats['db_pending'] -= 1
+
+    async def charts_body(self, options):
+        """Come dashboard.charts_body, ma il disegno gira nel pool di processi
+
+        Il thread dell'executor serve solo per leggere i dati; il risultato del
+        processo si attende sul loop, senza tenere occupato un thread.
+        """
+        if self.chart_executor is None:
+            return await self.run(dashboard.charts_body, options)
+        key = dashboard.charts_cache_key(options)
+        body = cache.get(key)
+        if body is not None:
+            return body
+        # Dopo un invalidate() la generazione cambia: chi arriva non aspetta un disegno
+        # partito sui dati vecchi, ma ne avvia uno nuovo
+        generation = cache.generation('charts')
+        pending = (key, generation)
+        task = self._renders.get(pending)
+        if task is None:
+            task = asyncio.ensure_future(self._render(key, options, generation))
+            self._renders[pending] = task
+            task.add_done_callback(lambda _: self._renders.pop(pending, None))
+        # shield: se un client si disconnette il disegno continua per gli altri
+        return await asyncio.shield(task)
+
+    async def _render(self, key, options, generation):
+        from chart_generator import render_charts
+        # Se i dati cambiano durante il calcolo (invalidate) il corpo non va in cache
+        df = await self.run(partial(dashboard.chart_data, **options))
+        if df is None:
+            return None
+        body = await asyncio.wrap_future(self.chart_executor.submit(
+            render_charts, df, options['charts'], max_points=options['max_points'],
+            data_only=options['data_only'], encoding=options['encoding']
+        ))
+        cache.set(key, body, DEFAULT_TTLS['charts'], generation=generation)
+        return body
+
+    async def respond(self, request, send, status, body, headers):
+        headers = list(headers)
+        if status == 200 and len(body) >= MIN_COMPRESS_SIZE:
+            accepted = parse_accept_header(request.headers.get('accept-encoding'))
+            body, encoding = await self.run(compress_body, body, accepted)
+            if encoding is not None:
+                headers += [('Content-Encoding', encoding), ('Vary', 'Accept-Encoding')]
+        headers.append(('Content-Length', str(len(body))))
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': _encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def json(self, body, etag=None, status=200):
+        """(stato, corpo, header) di una risposta JSON; ETag solo se non è un errore"""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        headers = [('Content-Type', 'application/json')]
+        if etag is not None and status == 200 and b'"error"' not in body[:20]:
+            headers += [('ETag', quote_etag(etag, weak=True)), ('Cache-Control', 'no-cache')]
+        return status, body, headers
+
+    async def conditional(self, request):
+        """Versione dei dati ed ETag come in http_cache.conditional
+
+        Restituisce anche la risposta 304 se il client ha già questa versione.
+        """
+        try:
+            version = await self.run(dashboard.data_version)
+        except Exception as e:
+            logging.warning(f"Version token unavailable: {e}")
+            version = None
+        if not version:
+            return None, None, None
+        etag = make_etag(version, date.today(), request.path, sorted(request.pairs))
+        if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+            return version, etag, (304, b'', [('ETag', quote_etag(etag, weak=True))])
+        return version, etag, None
+
+    async def charts(self, request):
+        version, etag, not_modified = await self.conditional(request)
+        if not_modified:
+            return not_modified
+        try:
+            options = dashboard.parse_chart_args(request.args)
+        except ValueError as e:
+            return self.json(self.dumps({'error': str(e)}), status=400)
+
+        try:
+            # Vista di default: la risposta è già pronta dal worker in background
+            view = dashboard.default_chart_view(request.args, options)
+            body = precomputer.get(view, version) if view is not None else None
+            if body is None:
+                body = await self.charts_body(options)
+            if body is None:
+                body = self.dumps({'error': 'No data available'})
+        except Exception as e:
+            logging.error(f"Error generating charts: {e}")
+            body = self.dumps({'error': str(e)})
+        return self.json(body, etag)
+
+    async def view(self, name, build, label, request):
+        """Vista JSON precalcolata o, se non pronta, costruita nell'executor"""
+        version, etag, not_modified = await self.conditional(request)
+        if not_modified:
+            return not_modified
+        body = precomputer.get(name, version)
+        if body is None:
+            try:
+                body = await self.run(lambda: self.dumps(build()))
+            except Exception as e:
+                logging.error(f"Error getting {label}: {e}")
+                body = self.dumps({'error': str(e)})
+        return self.json(body, etag)
+
+    async def asgi_stats(self, request):
+        return self.json(self.dumps(self.stats()))
+
+    async def stream(self, receive, send):
+        """Server-Sent Events: il client costa una coda e una coroutine, nessun thread"""
+        from live_updates import HEARTBEAT_INTERVAL
+        broadcast = self.broadcast
+        client = broadcast.subscribe()
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        self._record('dashboard.stream_updates', 200)
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': _encode_headers([
+                ('Content-Type', 'text/event-stream; charset=utf-8'),
+                ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no'),
+            ])})
+            await send({'type': 'http.response.body', 'body': b"retry: 5000\n\n",
+                        'more_body': True})
+            while broadcast.is_subscribed(client):
+                message = asyncio.ensure_future(client.get())
+                done, _ = await asyncio.wait(
+                    {message, disconnected}, timeout=HEARTBEAT_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if message not in done:
+                    message.cancel()
+                if disconnected in done:
+                    return
+                chunk = message.result() if message in done else ": ping\n\n"
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'),
+                            'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            broadcast.unsubscribe(client)
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def call_flask(self, scope, receive, send):
+        """Passa la richiesta all'app Flask (WSGI), eseguita in un thread dell'executor"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        self._stats['wsgi_requests'] += 1
+        response = {}
+        # Dati passati a write() (API WSGI legacy): vanno inviati prima dell'iterabile
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+            return written.append
+
+        chunks = await self.run(self.flask_app, wsgi_environ(scope, bytes(body)), start_response)
+        try:
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': _encode_headers(response['headers'])})
+            # Le risposte in streaming (es. export) si leggono un pezzo alla volta
+            iterator = iter(chunks)
+            while True:
+                while written:
+                    await send({'type': 'http.response.body', 'body': bytes(written.pop(0)),
+                                'more_body': True})
+                chunk = await self.run(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(chunks, 'close'):
+                await self.run(chunks.close)
+
+    def _record(self, endpoint, status, body=None, duration=None):
+        """Stesse metriche di metrics.init_app per le route servite in modo nativo"""
+        labels = (('endpoint', endpoint),)
+        metrics.registry.inc('dashboard_requests_total', (*labels, ('status', status)))
+        if duration is not None:
+            metrics.registry.observe('dashboard_request_duration_seconds', labels, duration)
+        if body is not None:
+            metrics.registry.observe(
+                'dashboard_response_bytes', labels, len(body), metrics.SIZE_BUCKETS
+            )
+        if status >= 500 or (body is not None and b'"error"' in body[:20]):
+            metrics.registry.inc('dashboard_request_errors_total', labels)
+
+    def stats(self):
+        return {
+            'db_threads': self.db_threads,
+            'chart_processes': self.chart_processes,
+            'sse_clients': len(self.broadcast.clients) if self.broadcast else 0,
+            **self._stats,
+        }
+
+
+app = AsgiDashboard(dashboard.app)
@@ -0,0 +1,51 @@
+"""Benchmark del downsampling: dimensione payload e tempo di generazione grafico
+
+Uso: python benchmarks/bench_downsampling.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chart_generator import ChartGenerator
+
+
+def synthetic_temperature(n):
+    """Serie di temperatura sintetica con n campioni (1 Hz)"""
+    rng = np.random.default_rng(42)
+    t = np.arange(n)
+    values = 25 + 5 * np.sin(t / 3600 * 2 * np.pi / 24) + rng.normal(0, 0.5, n)
+    return pd.DataFrame({
+        'parametro': 'Temperatura',
+        'asset': 'Aria',
+        'valore': values,
+        'data': pd.Timestamp('2024-01-01') + pd.to_timedelta(t, unit='s'),
+    })
+
+
+def run(sizes, max_points):
+    print(f"{'points':>9} {'mode':>8} {'payload KB':>11} {'time ms':>9}")
+    for n in sizes:
+        df = synthetic_temperature(n)
+        for label, points, method in (
+            ('raw', 0, None),
+            ('lttb', max_points, 'lttb'),
+            ('minmax', max_points, 'minmax'),
+        ):
+            gen = ChartGenerator(df, max_points=points, downsample_method=method)
+            start = time.perf_counter()
+            payload = gen.create_temperature_chart()
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"{n:>9} {label:>8} {len(payload) / 1024:>11.1f} {elapsed:>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--max-points', type=int, default=1000)
+    args = parser.parse_args()
+    run(args.sizes, args.max_points)
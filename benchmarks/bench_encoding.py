@@ -0,0 +1,60 @@
+"""Microbenchmark della codifica JSON delle tracce: PlotlyJSONEncoder vs encoder colonnare
+
+Uso: python benchmarks/bench_encoding.py [--sizes 1000 10000 100000] [--decimals 1]
+
+Con --decimals i valori vengono arrotondati come le letture dei sensori; senza,
+sono float a precisione piena.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chart_encoding import encode_traces
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def run(sizes, repeat, decimals=None):
+    print(f"{'points':>8} {'encoder':>10} {'bytes':>10} {'best ms':>9}")
+    for n in sizes:
+        x = (pd.Timestamp('2024-01-01') + pd.to_timedelta(np.arange(n), unit='s')).to_numpy()
+        y = np.random.default_rng(0).normal(25, 2, n)
+        if decimals is not None:
+            y = np.round(y, decimals)
+        trace = {'type': 'scatter', 'mode': 'lines', 'name': 'Temperatura'}
+
+        candidates = {
+            'plotly': lambda: json.dumps(
+                go.Figure(go.Scatter(x=x, y=y, mode='lines', name='Temperatura')),
+                cls=plotly.utils.PlotlyJSONEncoder,
+            ),
+            'columnar': lambda: encode_traces([{**trace, 'x': x, 'y': y}], 'json'),
+            'bdata': lambda: encode_traces([{**trace, 'x': x, 'y': y}], 'bdata'),
+        }
+        for name, func in candidates.items():
+            elapsed, payload = timed(func, repeat)
+            print(f"{n:>8} {name:>10} {len(payload):>10} {elapsed:>9.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--decimals', type=int, help="arrotonda i valori a N decimali")
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.decimals)
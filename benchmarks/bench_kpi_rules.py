@@ -0,0 +1,75 @@
+"""Benchmark del motore di regole KPI al crescere del numero di asset
+
+Uso: python benchmarks/bench_kpi_rules.py [--assets 10 100 1000 5000]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kpi_rules import KpiRuleEngine, sensor_columns
+
+RULES = [
+    {'parametro': 'Umidità', 'asset': '*', 'title': 'Umidità', 'unit': '%',
+     'critical': 10, 'low': 30, 'high': 80, 'max_rate': 20, 'stale_after': 900},
+    {'parametro': 'Temperatura', 'asset': '*', 'title': 'Temperatura', 'unit': '°C',
+     'low': 20, 'high': 30, 'max_rate': 5, 'stale_after': 900},
+]
+
+
+def synthetic_snapshot(n):
+    """Snapshot di Stato con n asset per parametro, alcuni fermi da ore"""
+    rng = np.random.default_rng(0)
+    now = datetime.now()
+    sensors = {}
+    rates = {}
+    for parametro, mean in (('Umidità', 55), ('Temperatura', 24)):
+        values = rng.normal(mean, mean / 3, n).round(1)
+        ages = rng.exponential(300, n)
+        for i in range(n):
+            key = f"{parametro}_Stalla{i}"
+            sensors[key] = {'value': float(values[i]),
+                            'timestamp': now - timedelta(seconds=float(ages[i]))}
+            rates[key] = float(rng.normal(0, 5))
+    return sensors, rates
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(sizes, repeat):
+    """columns ms: conversione dello snapshot (una volta per lettura di Stato);
+    evaluate ms: valutazione sulle colonne, come nelle richieste"""
+    engine = KpiRuleEngine(RULES)
+    print(f"{'assets':>7} {'kpis':>6} {'columns ms':>11} {'evaluate ms':>12} {'cached ms':>10}")
+    for n in sizes:
+        sensors, rates = synthetic_snapshot(n)
+        convert, columns = best_of(lambda: sensor_columns(sensors), repeat)
+        engine.evaluate(sensors, rates, columns=columns)
+        best, (kpis, _) = best_of(
+            lambda: engine.evaluate(sensors, rates, columns=columns), repeat
+        )
+        engine.summary(sensors, version=n, rates=rates, columns=columns)
+        cached, _ = best_of(
+            lambda: engine.summary(sensors, version=n, rates=rates, columns=columns), 1
+        )
+        print(f"{n:>7} {len(kpis):>6} {convert * 1000:>11.3f} {best * 1000:>12.3f} "
+              f"{cached * 1000:>10.4f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--assets', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(args.assets, args.repeat)
@@ -0,0 +1,114 @@
+"""Tempo di avvio di un worker: import dell'app, prima risposta e moduli più lenti
+
+Ogni misura gira in un processo nuovo (come un worker appena avviato). Il dettaglio
+degli import viene da `python -X importtime`.
+
+Uso: python benchmarks/bench_startup.py [--repeat 5] [--preload] [--top 15] [-o startup.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Moduli che l'app dovrebbe caricare solo al primo utilizzo
+HEAVY_MODULES = ('pandas', 'numpy', 'plotly', 'mysql.connector', 'pyarrow')
+
+CHILD = """
+import sys, time, json
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+status = client.get('/').status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_response_ms': (served - imported) * 1000,
+    'status': status,
+    'startup': app.app.config['STARTUP'],
+    'heavy_loaded': [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def child_env(preload):
+    env = dict(os.environ)
+    env['APP_PRELOAD'] = '1' if preload else '0'
+    return env
+
+
+def run_child(preload):
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=ROOT, env=child_env(preload),
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(preload, top):
+    """Moduli importati direttamente da app con il tempo cumulativo più alto"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT,
+        env=child_env(preload), capture_output=True, text=True, check=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Due spazi di indentazione per livello; i figli precedono il genitore, quindi
+        # gli import di livello 1 appartengono al primo modulo di livello 0 che segue
+        name = name[1:]
+        level = (len(name) - len(name.lstrip())) // 2
+        if level == 1:
+            modules.append((name.strip(), int(cumulative) / 1000))
+        elif level == 0:
+            if name.strip() == 'app':
+                break
+            modules = []
+    modules.sort(key=lambda item: item[1], reverse=True)
+    return modules[:top]
+
+
+def run(repeat, preload, top):
+    samples = [run_child(preload) for _ in range(repeat)]
+    import_ms = sorted(s['import_ms'] for s in samples)
+    first_ms = sorted(s['first_response_ms'] for s in samples)
+    report = {
+        'preload': preload,
+        'repeat': repeat,
+        'import_ms': {'min': round(import_ms[0], 1), 'p50': round(import_ms[len(import_ms) // 2], 1)},
+        'first_response_ms': {'min': round(first_ms[0], 1), 'p50': round(first_ms[len(first_ms) // 2], 1)},
+        'startup': samples[-1]['startup'],
+        'heavy_loaded': samples[-1]['heavy_loaded'],
+        'top_imports_ms': import_profile(preload, top),
+    }
+
+    print(f"import app          min {report['import_ms']['min']:>8.1f} ms  "
+          f"p50 {report['import_ms']['p50']:>8.1f} ms  (preload={preload})")
+    print(f"first GET /         min {report['first_response_ms']['min']:>8.1f} ms  "
+          f"p50 {report['first_response_ms']['p50']:>8.1f} ms")
+    for key, value in report['startup'].items():
+        print(f"{key:<20}{value:>12.1f} ms")
+    print(f"heavy modules loaded: {', '.join(report['heavy_loaded']) or 'none'}")
+    print("top imports (cumulative):")
+    for name, ms in report['top_imports_ms']:
+        print(f"  {name:<40} {ms:>8.1f} ms")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--preload', action='store_true',
+                        help="misura con APP_PRELOAD=1 (moduli, grafici e pool prima del fork)")
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('-o', '--output', help="salva il report in JSON")
+    args = parser.parse_args()
+    report = run(args.repeat, args.preload, args.top)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,186 @@
+"""Benchmark dei percorsi principali su dati sintetici, con risultati in JSON
+
+Misura get_sensor_data, i grafici di ChartGenerator, create_dashboard_summary e
+gli endpoint Flask (test client) su un database SQLite sostitutivo.
+
+Uso: python benchmarks/bench_suite.py --days 7 --hz 0.0167 -o results.json
+     python benchmarks/bench_suite.py --compare results.json   # confronta con un'esecuzione precedente
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+# Prima di importare l'app: niente thread in background né checkpoint su disco
+os.environ.setdefault('PRECOMPUTE_ENABLED', '0')
+os.environ.setdefault('DAILY_COUNTERS_CHECKPOINT', '')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db_pool
+from synthetic import SENSORS, StandInPool, create_database, generate_storico
+
+
+def _payload_size(result):
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    data = getattr(result, 'data', None)
+    if isinstance(data, bytes):
+        return len(data)
+    return None
+
+
+def measure(func, repeat, setup=None):
+    """Percentili di latenza, dimensione del risultato e picco di memoria"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    # Il picco di memoria si misura a parte: tracemalloc rallenta l'esecuzione
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        'repeat': repeat,
+        'min_ms': round(float(timings.min()), 3),
+        'p50_ms': round(float(np.percentile(timings, 50)), 3),
+        'p90_ms': round(float(np.percentile(timings, 90)), 3),
+        'p99_ms': round(float(np.percentile(timings, 99)), 3),
+        'max_ms': round(float(timings.max()), 3),
+        'payload_bytes': _payload_size(result),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run(days, hz, n_sensors, repeat, db_path):
+    print(f"Generating {days} days x {n_sensors} sensors x {hz:g} Hz ...")
+    storico = generate_storico(days, hz, n_sensors)
+    create_database(db_path, storico)
+    db_pool._pool = StandInPool(db_path)
+
+    from cache import cache
+    from database import FarmDatabase
+    from chart_generator import ChartGenerator
+    from sensor_history import sensor_history
+    from kpi_rules import kpi_engine
+    import app as dashboard
+
+    db = FarmDatabase()
+    client = dashboard.app.test_client()
+
+    def cold():
+        # Ogni ripetizione riparte senza cache, finestra in memoria né KPI già valutati
+        cache.invalidate()
+        sensor_history.series.clear()
+        sensor_history.last_seen = None
+        kpi_engine._cached = None
+
+    df_24h = FarmDatabase.get_sensor_data.uncached(db, hours_back=24)
+    snapshot = db.get_stato_snapshot()
+
+    cases = {
+        'get_sensor_data[1h]': (lambda: db.get_sensor_data(hours_back=1), cold),
+        'get_sensor_data[24h]': (lambda: db.get_sensor_data(hours_back=24), cold),
+        'get_sensor_data[full,downsampled]': (
+            lambda: db.get_sensor_data(hours_back=days * 24), cold
+        ),
+        'get_sensor_data[full,raw]': (
+            lambda: db.get_sensor_data(hours_back=days * 24, max_points=0), cold
+        ),
+    }
+    for name in ('humidity', 'resources', 'temperature'):
+        method = f"create_{name}_chart"
+        cases[f"ChartGenerator.{method}"] = (
+            lambda method=method: getattr(ChartGenerator(df_24h), method)(), None
+        )
+    cases['ChartGenerator.create_dashboard_summary'] = (
+        lambda: ChartGenerator(df_24h).create_dashboard_summary(
+            snapshot.get('sensors', {}), columns=snapshot.get('columns')
+        ),
+        None,
+    )
+    for url in ('/api/charts', '/api/charts?encoding=bdata', '/api/kpis',
+                '/api/system-status', '/api/latest-data'):
+        cases[f"GET {url} (cold)"] = (lambda url=url: client.get(url), cold)
+        cases[f"GET {url} (warm)"] = (lambda url=url: client.get(url), None)
+
+    results = {}
+    for name, (func, setup) in cases.items():
+        results[name] = measure(func, repeat, setup)
+        r = results[name]
+        print(f"{name:<48} p50 {r['p50_ms']:>9.2f} ms  p90 {r['p90_ms']:>9.2f} ms  "
+              f"peak {r['peak_memory_kb']:>9.1f} KB  bytes {r['payload_bytes'] or '-'}")
+
+    import pandas as pd
+    import plotly
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'days': days,
+            'hz': hz,
+            'sensors': n_sensors,
+            'storico_rows': len(storico),
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'plotly': plotly.__version__,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current):
+    """Variazione del p50 rispetto a un'esecuzione precedente"""
+    print(f"\n{'case':<48} {'base p50':>10} {'now p50':>10} {'change':>8}")
+    for name, now in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        change = (now['p50_ms'] / base['p50_ms'] - 1) * 100 if base['p50_ms'] else 0.0
+        print(f"{name:<48} {base['p50_ms']:>10.2f} {now['p50_ms']:>10.2f} {change:>+7.1f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--hz', type=float, default=1 / 60, help='campioni al secondo per sensore')
+    parser.add_argument('--sensors', type=int, default=len(SENSORS))
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--db', help='file SQLite da generare (default: temporaneo)')
+    parser.add_argument('-o', '--output', help='file JSON dei risultati')
+    parser.add_argument('--compare', help='JSON di un\'esecuzione precedente da confrontare')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run(
+            args.days, args.hz, args.sensors, args.repeat,
+            args.db or os.path.join(tmp, 'farm.db'),
+        )
+        db_pool.get_pool().close_all()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
@@ -0,0 +1,124 @@
+"""Generatore di telemetria sintetica (Storico/Stato) e database SQLite sostitutivo
+
+Uso: python benchmarks/synthetic.py --days 7 --hz 0.0167 -o /tmp/farm.db
+"""
+import argparse
+import os
+import sys
+import sqlite3
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_pool import ConnectionPool
+from replica import SCHEMA, ReplicaConnection
+
+# (parametro, asset, media, ampiezza ciclo giornaliero, rumore)
+SENSORS = [
+    ('Umidità', 'Terreno', 55, 15, 3),
+    ('Umidità', 'Aria', 60, 20, 4),
+    ('Temperatura', 'Aria', 22, 6, 0.8),
+    ('Silos', 'Mangime', 50, 30, 1),
+    ('Serbatoio', 'Acqua', 50, 30, 1),
+]
+
+STATE_ASSETS = ('Servo', 'Pompa')
+
+
+def _sensor_specs(n_sensors):
+    """I sensori della dashboard, più sensori extra fino a n_sensors"""
+    specs = list(SENSORS[:n_sensors])
+    for i in range(len(specs), n_sensors):
+        parametro, _, mean, amplitude, noise = SENSORS[i % len(SENSORS)]
+        specs.append((parametro, f"Extra{i}", mean, amplitude, noise))
+    return specs
+
+
+def generate_storico(days=1, hz=1 / 60, n_sensors=len(SENSORS), end=None, seed=42):
+    """Storico sintetico: days giorni a hz campioni/s per sensore, più stato di servo e pompa"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or datetime.now()).floor('s')
+    n = max(int(days * 86400 * hz), 1)
+    times = end - pd.to_timedelta(np.arange(n)[::-1] / hz, unit='s')
+    day_phase = 2 * np.pi * (times.hour * 3600 + times.minute * 60 + times.second) / 86400
+
+    frames = []
+    for parametro, asset, mean, amplitude, noise in _sensor_specs(n_sensors):
+        values = mean + amplitude * np.sin(day_phase) + rng.normal(0, noise, n)
+        frames.append(pd.DataFrame({
+            'parametro': parametro,
+            'asset': asset,
+            'valore': np.round(values, 1).astype(str),
+            'data': times,
+        }))
+    for asset in STATE_ASSETS:
+        # Stato ON per circa il 15% dei campioni, a blocchi
+        on = rng.random(n) < 0.15
+        frames.append(pd.DataFrame({
+            'parametro': 'Stato',
+            'asset': asset,
+            'valore': np.where(on, 'ON', 'OFF'),
+            'data': times,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def stato_from_storico(storico):
+    """Ultimo valore di ogni (parametro, asset), come nella tabella Stato"""
+    return storico.sort_values('data').groupby(['parametro', 'asset'], as_index=False).last()
+
+
+def create_database(path, storico, stato=None):
+    """Scrive Storico e Stato in un file SQLite con lo schema della replica"""
+    if os.path.exists(path):
+        os.unlink(path)
+    stato = stato_from_storico(storico) if stato is None else stato
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        for table, df in (('Storico', storico), ('Stato', stato)):
+            rows = zip(
+                df['parametro'], df['asset'], df['valore'],
+                df['data'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+            )
+            conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class StandInConnection(ReplicaConnection):
+    """Connessione SQLite con l'interfaccia minima usata dal pool"""
+
+    in_transaction = False
+
+    def ping(self, **kwargs):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class StandInPool(ConnectionPool):
+    """Pool che apre connessioni al database SQLite sostitutivo invece di MySQL"""
+
+    def __init__(self, path, size=5, timeout=10.0):
+        super().__init__({'database': path}, size=size, timeout=timeout)
+
+    def _new_connection(self):
+        return StandInConnection(self.config['database'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=float, default=1)
+    parser.add_argument('--hz', type=float, default=1 / 60, help='campioni al secondo per sensore')
+    parser.add_argument('--sensors', type=int, default=len(SENSORS))
+    parser.add_argument('-o', '--output', required=True, help='file SQLite di destinazione')
+    args = parser.parse_args()
+
+    storico = generate_storico(args.days, args.hz, args.sensors)
+    create_database(args.output, storico)
+    print(f"Wrote {len(storico)} Storico rows to {args.output}")
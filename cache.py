@@ -0,0 +1,276 @@
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from shared_cache import CACHE_SHARED_DIR, SharedStore, LockTimeout
+
+# TTL di default (secondi) per famiglia di chiavi, sovrascrivibili da env
+DEFAULT_TTLS = {
+    'sensor_data': float(os.getenv('CACHE_TTL_SENSOR_DATA', 15)),
+    'stato_snapshot': float(os.getenv('CACHE_TTL_STATO_SNAPSHOT', 5)),
+    'system_statistics': float(os.getenv('CACHE_TTL_SYSTEM_STATISTICS', 30)),
+    'charts': float(os.getenv('CACHE_TTL_CHARTS', 15)),
+    'watermarks': float(os.getenv('CACHE_TTL_WATERMARKS', 2)),
+}
+
+# Famiglie con dati letti dal DB: non valgono più quando cambia la versione dei dati
+DATA_FAMILIES = ('stato_snapshot', 'system_statistics', 'sensor_data', 'charts')
+
+# Famiglie condivise tra i processi worker quando CACHE_SHARED_DIR è impostato:
+# payload piccoli e costosi; i DataFrame di sensor_data restano locali
+SHARED_FAMILIES = tuple(
+    family.strip() for family in os.getenv(
+        'CACHE_SHARED_FAMILIES', 'charts,precomputed,stato_snapshot,system_statistics'
+    ).split(',') if family.strip()
+)
+
+
+class _InFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        # Invalidato durante il calcolo: il valore può essere vecchio, non va salvato
+        self.stale = False
+
+
+class TTLCache:
+    """Cache LRU con TTL per chiave e single-flight sui miss concorrenti"""
+
+    def __init__(self, maxsize=256, shared=None, shared_families=SHARED_FAMILIES):
+        self.maxsize = maxsize
+        self.shared = shared
+        self.shared_families = shared_families
+        self._data = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._local_locks = {}
+        self._stats = {}
+        # Contatori di invalidate(): chi calcola fuori da get_or_compute li confronta
+        self._generations = {}
+
+    def _count(self, key, field):
+        family = key[0] if isinstance(key, tuple) else key
+        stats = self._stats.setdefault(
+            family, {'hits': 0, 'misses': 0, 'waits': 0, 'evictions': 0, 'shared_hits': 0}
+        )
+        stats[field] += 1
+
+    def _is_shared(self, key):
+        family = key[0] if isinstance(key, tuple) else key
+        return self.shared is not None and family in self.shared_families
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._data.move_to_end(key)
+                return entry[1]
+        if not self._is_shared(key):
+            return None
+        found = self.shared.get(key)
+        if found is None:
+            return None
+        value, remaining = found
+        with self._lock:
+            self._store(key, value, remaining)
+        return value
+
+    def _local_generation(self, family):
+        return self._generations.get(None, 0), self._generations.get(family, 0)
+
+    def generation(self, family):
+        """Token che cambia a ogni invalidate() della famiglia (o dell'intera cache),
+        anche da parte di altri processi per le famiglie condivise"""
+        shared = self.shared.generation(family) if self._is_shared(family) else None
+        with self._lock:
+            return self._local_generation(family), shared
+
+    def set(self, key, value, ttl, generation=None):
+        """Salva il valore; con generation solo se la famiglia non è stata invalidata"""
+        family = key[0] if isinstance(key, tuple) else key
+        local, shared = generation if generation is not None else (None, None)
+        with self._lock:
+            if local is not None and local != self._local_generation(family):
+                return
+            self._store(key, value, ttl)
+        if self._is_shared(key):
+            self.shared.set(key, value, ttl, generation=shared)
+
+    @contextmanager
+    def lock(self, name, blocking=True):
+        """Lock con nome, tra processi se la cache è condivisa; produce False se occupato"""
+        if self.shared is not None:
+            with self.shared.lock(name, blocking=blocking) as acquired:
+                yield acquired
+            return
+        with self._lock:
+            lock = self._local_locks.setdefault(name, threading.Lock())
+        acquired = lock.acquire(blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+
+    def _compute(self, key, compute, ttl, cache_if):
+        """Calcola il valore; per le famiglie condivise un solo processo lo calcola"""
+        if not self._is_shared(key):
+            return compute(), ttl
+        found = self.shared.get(key)
+        if found is None:
+            try:
+                with self.shared.lock(key):
+                    # Un altro processo può averlo calcolato mentre si aspettava il lock
+                    found = self.shared.get(key)
+                    if found is None:
+                        # Se un processo invalida la famiglia durante il calcolo il
+                        # valore può essere vecchio: non va scritto per tutti
+                        generation = self.shared.generation(
+                            key[0] if isinstance(key, tuple) else key
+                        )
+                        value = compute()
+                        if cache_if is None or cache_if(value):
+                            self.shared.set(key, value, ttl, generation=generation)
+                        return value, ttl
+            except LockTimeout as e:
+                logging.warning(f"{e}: computing locally")
+                return compute(), ttl
+        with self._lock:
+            self._count(key, 'shared_hits')
+        return found
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            old_key, _ = self._data.popitem(last=False)
+            self._count(old_key, 'evictions')
+
+    def get_or_compute(self, key, compute, ttl, cache_if=None):
+        """Restituisce il valore in cache o lo calcola una sola volta per chiave"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._data.move_to_end(key)
+                self._count(key, 'hits')
+                return entry[1]
+            flight = self._inflight.get(key)
+            if flight is None:
+                flight = _InFlight()
+                self._inflight[key] = flight
+                leader = True
+                self._count(key, 'misses')
+            else:
+                leader = False
+                self._count(key, 'waits')
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value, ttl = self._compute(key, compute, ttl, cache_if)
+            flight.value = value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and not flight.stale and (
+                    cache_if is None or cache_if(flight.value)
+                ):
+                    self._store(key, flight.value, ttl)
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+            flight.event.set()
+        return value
+
+    def invalidate(self, family=None):
+        def matches(key):
+            return family is None or (isinstance(key, tuple) and key[0] == family)
+
+        with self._lock:
+            self._generations[family] = self._generations.get(family, 0) + 1
+            for key in [k for k in self._data if matches(k)]:
+                del self._data[key]
+            # I calcoli in corso hanno letto dati precedenti: le richieste successive
+            # ne avviano uno nuovo invece di attenderne il risultato
+            for key in [k for k in self._inflight if matches(k)]:
+                self._inflight.pop(key).stale = True
+        if self.shared is not None and (family is None or family in self.shared_families):
+            self.shared.invalidate(family)
+
+    def stats(self):
+        with self._lock:
+            stats = {family: dict(values) for family, values in self._stats.items()}
+            for values in stats.values():
+                lookups = values['hits'] + values['misses'] + values['waits']
+                values['hit_ratio'] = round(
+                    (values['hits'] + values['waits'] + values['shared_hits']) / lookups, 3
+                ) if lookups else 0.0
+            result = {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'families': stats,
+            }
+        if self.shared is not None:
+            result['shared'] = self.shared.stats()
+        return result
+
+
+cache = TTLCache(
+    maxsize=int(os.getenv('CACHE_MAXSIZE', 256)),
+    shared=SharedStore(CACHE_SHARED_DIR) if CACHE_SHARED_DIR else None,
+)
+
+
+# Attivo dentro refreshing(): propagato ai thread di run_parallel con il contesto
+_refreshing = ContextVar('cache_refreshing', default=False)
+
+
+@contextmanager
+def refreshing():
+    """Nel blocco i metodi @cached leggono sempre dal DB e aggiornano la cache
+
+    Serve a chi salva il risultato insieme a una versione dei dati (precompute):
+    una voce in cache può essere precedente a quella versione.
+    """
+    token = _refreshing.set(True)
+    try:
+        yield
+    finally:
+        _refreshing.reset(token)
+
+
+def _not_empty(value):
+    empty = getattr(value, 'empty', None)
+    if empty is not None:
+        return not empty
+    return bool(value)
+
+
+def cached(family, ttl=None):
+    """Decoratore per metodi di FarmDatabase: chiave = famiglia + argomenti"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            key = (family, args, tuple(sorted(kwargs.items())))
+            family_ttl = ttl if ttl is not None else DEFAULT_TTLS[family]
+            if _refreshing.get():
+                value = func(self, *args, **kwargs)
+                if _not_empty(value):
+                    cache.set(key, value, family_ttl)
+                return value
+            return cache.get_or_compute(
+                key, lambda: func(self, *args, **kwargs), family_ttl, cache_if=_not_empty
+            )
+        wrapper.uncached = func
+        return wrapper
+    return decorator
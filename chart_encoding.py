@@ -0,0 +1,214 @@
+import base64
+import json
+import numpy as np
+
+ENCODINGS = ('json', 'bdata')
+
+
+def dates_to_iso(x):
+    """Date come stringhe ISO al millisecondo, convertite in blocco"""
+    x = np.asarray(x).astype('datetime64[ms]')
+    return np.datetime_as_string(x, unit='ms').tolist()
+
+
+def dates_to_epoch_ms(x):
+    """Date come millisecondi epoch (interi), per assi Plotly di tipo date"""
+    return np.asarray(x).astype('datetime64[ms]').astype(np.int64).tolist()
+
+
+SPACE = ord(' ')
+# Decimali massimi per cui i valori si scrivono in virgola fissa (vedi _exact_decimals)
+MAX_FIXED_DECIMALS = 6
+
+
+# Cifre ASCII dei numeri 0-9999: le righe si copiano invece di dividere cifra per cifra
+_DIGIT_TABLE = np.array(
+    [list(f'{i:04d}'.encode()) for i in range(10_000)], dtype=np.uint8
+)
+
+
+def _digits(values, width):
+    """Cifre ASCII di interi non negativi, width colonne con zeri iniziali"""
+    values = np.asarray(values, dtype=np.int64)
+    chunks = []
+    for _ in range(-(-width // 4)):
+        chunks.append(_DIGIT_TABLE[values % 10_000])
+        values = values // 10_000
+    digits = np.hstack(chunks[::-1]) if len(chunks) > 1 else chunks[0]
+    return digits[:, digits.shape[1] - width:]
+
+
+def _join_rows(rows, padded=True):
+    """Lista JSON da una matrice di byte con una riga per elemento terminata da ','
+
+    Con padded gli spazi di riempimento vengono tolti: le righe possono avere
+    lunghezze diverse.
+    """
+    buf = rows.ravel()
+    if padded:
+        buf = buf[buf != SPACE]
+    return '[' + buf[:-1].tobytes().decode('ascii') + ']'
+
+
+def _clock_table():
+    """"HH:MM:SS" per ogni secondo del giorno, calcolata una volta sola"""
+    global _CLOCK
+    if _CLOCK is None:
+        seconds = np.arange(86_400)
+        clock = np.empty((86_400, 8), dtype=np.uint8)
+        clock[:, [2, 5]] = ord(':')
+        clock[:, 0:2] = _digits(seconds // 3600, 2)
+        clock[:, 3:5] = _digits(seconds // 60 % 60, 2)
+        clock[:, 6:8] = _digits(seconds % 60, 2)
+        _CLOCK = clock
+    return _CLOCK
+
+
+_CLOCK = None
+# Oltre questo numero di giorni distinti si usa la conversione generica
+MAX_DATE_SPAN_DAYS = 100_000
+
+
+def _dates_json(x):
+    """Date ISO al millisecondo (come dates_to_iso) composte a blocchi di byte
+
+    Giorno e ora vengono da tabelle (i giorni coperti da una serie sono pochi): si
+    evita di formattare una stringa per punto.
+    """
+    x = np.asarray(x).astype('datetime64[ms]')
+    if not len(x):
+        return '[]'
+    days = x.astype('datetime64[D]')
+    first, last = days.min(), days.max()
+    if np.isnat(x).any() or (last - first).astype(np.int64) >= MAX_DATE_SPAN_DAYS:
+        # Casi rari (NaT, intervalli di secoli): conversione generica
+        return '["' + '","'.join(dates_to_iso(x)) + '"]'
+    calendar = np.datetime_as_string(np.arange(first, last + 1))
+    if len(calendar[0]) != 10 or len(calendar[-1]) != 10:
+        # Anni fuori dalle quattro cifre
+        return '["' + '","'.join(dates_to_iso(x)) + '"]'
+    calendar = calendar.astype('S10').view(np.uint8).reshape(-1, 10)
+    ms = (x - days).astype(np.int64)
+    rows = np.empty((len(x), 26), dtype=np.uint8)
+    rows[:, [0, 24]] = ord('"')
+    rows[:, 11] = ord('T')
+    rows[:, 20] = ord('.')
+    rows[:, 25] = ord(',')
+    rows[:, 1:11] = calendar[(days - first).astype(np.int64)]
+    rows[:, 12:20] = _clock_table()[ms // 1000]
+    rows[:, 21:24] = _DIGIT_TABLE[ms % 1000, 1:]
+    return _join_rows(rows, padded=False)
+
+
+def _exact_decimals(y):
+    """Minimo numero di decimali che rappresenta esattamente ogni valore, o None
+
+    I valori dei sensori hanno pochi decimali: in virgola fissa si scrivono in blocco
+    e la stringa si rilegge come lo stesso float. Un campione evita di provare tutti
+    i decimali su serie a precisione piena, che restano sul percorso generico.
+    """
+    finite = y[~np.isnan(y)]
+    if not len(finite) or not np.isfinite(finite).all():
+        return None
+    largest = np.abs(finite).max()
+    sample = finite[:64]
+    for decimals in range(MAX_FIXED_DECIMALS + 1):
+        if largest * 10 ** decimals >= 2 ** 53:
+            return None
+        if (np.round(sample, decimals) == sample).all():
+            if (np.round(finite, decimals) == finite).all():
+                return decimals
+    return None
+
+
+def _fixed_json(y, decimals):
+    """Lista JSON di float con decimals cifre decimali, NaN come null"""
+    nan = np.isnan(y)
+    scale = 10 ** decimals
+    scaled = np.rint(np.abs(np.where(nan, 0, y)) * scale).astype(np.int64)
+    whole, fraction = np.divmod(scaled, scale)
+    int_width = len(str(int(whole.max())))
+    frac_width = decimals + 1 if decimals else 0
+    width = max(1 + int_width + frac_width + 1, len('null,'))
+    rows = np.full((len(y), width), SPACE, dtype=np.uint8)
+    rows[:, 0] = np.where((y < 0) & (scaled > 0), ord('-'), SPACE)
+    end = width - 1 - frac_width
+    digits = _digits(whole, int_width)
+    # Niente zeri iniziali nella parte intera, tranne l'ultima cifra
+    leading = whole[:, None] < 10 ** np.arange(int_width - 1, -1, -1, dtype=np.int64)
+    leading[:, -1] = False
+    digits[leading] = SPACE
+    rows[:, end - int_width:end] = digits
+    if decimals:
+        rows[:, end] = ord('.')
+        rows[:, end + 1:width - 1] = _digits(fraction, decimals)
+    rows[:, -1] = ord(',')
+    if nan.any():
+        rows[nan] = SPACE
+        rows[nan, :4] = np.frombuffer(b'null', dtype=np.uint8)
+        rows[nan, -1] = ord(',')
+    return _join_rows(rows)
+
+
+def _typed_array(values, dtype='f8'):
+    return {
+        'dtype': dtype,
+        'bdata': base64.b64encode(values.astype('<' + dtype).tobytes()).decode('ascii'),
+    }
+
+
+def encode_x(x, bdata=False):
+    """Asse x: date ISO oppure millisecondi epoch come typed array (asse di tipo date)"""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        if bdata:
+            epoch_ms = x.astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+            return json.dumps(_typed_array(epoch_ms))
+        return _dates_json(x)
+    if np.issubdtype(x.dtype, np.floating):
+        return encode_y(x)
+    return json.dumps(x.tolist())
+
+
+def encode_y(y, bdata=False):
+    """Valori numerici come lista JSON o come typed array base64 di Plotly.js"""
+    y = np.asarray(y)
+    if y.dtype == np.float32:
+        # Le letture compatte sono float32: si evitano cifre spurie nel JSON
+        y = np.round(y.astype(np.float64), 4)
+    y = y.astype(np.float64, copy=False)
+    if bdata:
+        return json.dumps(_typed_array(y))
+    if not len(y):
+        return '[]'
+    decimals = _exact_decimals(y)
+    if decimals is not None:
+        return _fixed_json(y, decimals)
+    values = y.tolist()
+    invalid = ~np.isfinite(y)
+    if invalid.any():
+        # NaN e ±inf non sono JSON valido: null come PlotlyJSONEncoder
+        for i in np.flatnonzero(invalid).tolist():
+            values[i] = None
+    return json.dumps(values)
+
+
+def encode_traces(traces, encoding='json'):
+    """Serializza tracce con array x/y numpy senza passare da PlotlyJSONEncoder"""
+    bdata = encoding == 'bdata'
+    encoded = []
+    for trace in traces:
+        meta = {k: v for k, v in trace.items() if k not in ('x', 'y')}
+        head = json.dumps(meta, ensure_ascii=False)[:-1] + (', ' if meta else '')
+        encoded.append(
+            head + '"x": ' + encode_x(trace['x'], bdata)
+            + ', "y": ' + encode_y(trace['y'], bdata) + '}'
+        )
+    return '[' + ', '.join(encoded) + ']'
+
+
+def join_json_object(items):
+    """Compone un oggetto JSON da valori già serializzati, senza ricodificarli"""
+    return '{' + ','.join(
+        f'{json.dumps(key)}:{value}' for key, value in items.items()
+    ) + '}'
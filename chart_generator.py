@@ -3,11 +3,35 @@ from plotly.subplots import make_subplots
 import pandas as pd
 import json
 import plotly
+from downsampling import downsample
+from chart_encoding import encode_traces, join_json_object
+from metrics import span
+from kpi_rules import kpi_engine, rates_per_hour
 
 
 class ChartGenerator:
-    def __init__(self, df):
+    _EMPTY = pd.DataFrame(
+        {"data": pd.Series(dtype="datetime64[ns]"), "valore": pd.Series(dtype=float)}
+    )
+
+    def __init__(
+        self,
+        df,
+        max_points=None,
+        downsample_method=None,
+        data_only=False,
+        encoding="json",
+    ):
         self.df = df
+        # Numero massimo di punti per traccia (0 = nessun downsampling)
+        self.max_points = max_points
+        self.downsample_method = downsample_method
+        # Se True i grafici contengono solo le tracce, senza layout
+        self.data_only = data_only
+        # "bdata" codifica i valori y come typed array base64 di Plotly.js
+        self.encoding = encoding
+        with span("dataframe"):
+            self.series = self._partition(df)
         # Palette colori professionale e centralizzata
         self.colors = {
             "soil": "#a5682a",
@@ -39,6 +63,38 @@ class ChartGenerator:
             "margin": {"l": 60, "r": 30, "t": 80, "b": 50},
         }
 
+    @staticmethod
+    def _partition(df):
+        """Divide i dati una sola volta in serie (parametro, asset) ordinate per data"""
+        if df.empty:
+            return {}
+        keys = df[["parametro", "asset"]].astype("category")
+        series = {}
+        for key, part in df[["data", "valore"]].groupby(
+            [keys["parametro"], keys["asset"]], observed=True, sort=False
+        ):
+            dates = part["data"]
+            # Il DB restituisce ORDER BY data DESC: basta invertire
+            if dates.is_monotonic_decreasing:
+                part = part.iloc[::-1]
+            elif not dates.is_monotonic_increasing:
+                part = part.sort_values("data", kind="stable")
+            series[key] = part
+        return series
+
+    def _get_series(self, parametro, asset):
+        """Serie già ordinata per (parametro, asset), vuota se assente"""
+        return self.series.get((parametro, asset), self._EMPTY)
+
+    def _xy(self, data):
+        """Serie x/y di una traccia, ridotta a max_points punti"""
+        return downsample(
+            data["data"].to_numpy(),
+            data["valore"].to_numpy(),
+            self.max_points,
+            self.downsample_method,
+        )
+
     def _create_empty_chart(self, message):
         """Crea un grafico vuoto con messaggio"""
         fig = go.Figure()
@@ -54,12 +110,51 @@ class ChartGenerator:
         fig.update_layout(height=300, **self.default_layout)
         return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
 
-    def create_humidity_chart(self):
-        """Grafico umidità terreno e aria migliorato"""
-        humidity_data = self.df[self.df["parametro"] == "Umidità"].copy()
-        if humidity_data.empty:
-            return self._create_empty_chart("Nessun dato di umidità disponibile")
+    # Scheletri (tracce senza dati + layout serializzato) costruiti una volta per processo
+    _skeletons = {}
+
+    # Serie mostrate da ogni grafico, nell'ordine delle tracce dello scheletro
+    CHART_SERIES = {
+        "humidity": [("Umidità", "Terreno"), ("Umidità", "Aria")],
+        "resources": [("Silos", "Mangime"), ("Serbatoio", "Acqua")],
+        "temperature": [("Temperatura", "Aria")],
+    }
 
+    def _skeleton(self, name):
+        """Tracce senza x/y e layout JSON del grafico, serializzati una sola volta"""
+        skeleton = ChartGenerator._skeletons.get(name)
+        if skeleton is None:
+            fig = getattr(self, f"_build_{name}_figure")()
+            figure = json.loads(json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder))
+            skeleton = (figure["data"], json.dumps(figure["layout"]))
+            ChartGenerator._skeletons[name] = skeleton
+        return skeleton
+
+    @classmethod
+    def warm_up(cls):
+        """Costruisce subito gli scheletri di tutti i grafici (es. prima del fork dei worker)"""
+        generator = cls(pd.DataFrame())
+        for name in cls.CHART_SERIES:
+            generator._render(name)
+
+    def _render(self, name):
+        """Applica le serie correnti allo scheletro del grafico"""
+        with span("figure"):
+            traces, layout_json = self._skeleton(name)
+            data = []
+            for trace, key in zip(traces, self.CHART_SERIES[name]):
+                series = self._get_series(*key)
+                if series.empty:
+                    continue
+                x, y = self._xy(series)
+                data.append({**trace, "x": x, "y": y})
+        with span("json_encode"):
+            data_json = encode_traces(data, self.encoding)
+        if self.data_only:
+            return '{"data": ' + data_json + "}"
+        return '{"data": ' + data_json + ', "layout": ' + layout_json + "}"
+
+    def _build_humidity_figure(self):
         fig = make_subplots(
             rows=2,
             cols=1,
@@ -67,99 +162,77 @@ class ChartGenerator:
             vertical_spacing=0.2,
             shared_xaxes=True,
         )
-
-        soil_humidity = humidity_data[
-            humidity_data["asset"] == "Terreno"
-        ].sort_values("data")
-
-        if not soil_humidity.empty:
-            fig.add_trace(
-                go.Scatter(
-                    x=soil_humidity["data"],
-                    y=soil_humidity["valore"],
-                    mode="lines+markers",
-                    name="Terreno",
-                    line=dict(color=self.colors["soil"], width=2.5),
-                    marker=dict(size=4),
-                ),
-                row=1,
-                col=1,
-            )
-
-        air_humidity = humidity_data[humidity_data["asset"] == "Aria"].sort_values(
-            "data"
+        fig.add_trace(
+            go.Scatter(
+                x=[],
+                y=[],
+                mode="lines+markers",
+                name="Terreno",
+                line=dict(color=self.colors["soil"], width=2.5),
+                marker=dict(size=4),
+            ),
+            row=1,
+            col=1,
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=[],
+                y=[],
+                mode="lines+markers",
+                name="Aria",
+                line=dict(color=self.colors["air_humidity"], width=2.5),
+                marker=dict(size=4),
+            ),
+            row=2,
+            col=1,
         )
-        if not air_humidity.empty:
-            fig.add_trace(
-                go.Scatter(
-                    x=air_humidity["data"],
-                    y=air_humidity["valore"],
-                    mode="lines+markers",
-                    name="Aria",
-                    line=dict(color=self.colors["air_humidity"], width=2.5),
-                    marker=dict(size=4),
-                ),
-                row=2,
-                col=1,
-            )
 
         fig.update_layout(height=500, **self.default_layout)
         fig.update_xaxes(
-            showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
+            type="date", showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
         )
         fig.update_yaxes(
             showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
         )
-        return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+        return fig
 
-    def create_resources_chart(self):
-        """Grafico risorse migliorato"""
+    def _build_resources_figure(self):
         fig = make_subplots(
             rows=1,
             cols=2,
             subplot_titles=("Livello Mangime (%)", "Livello Acqua (%)"),
             horizontal_spacing=0.1,
         )
-
-        feed_data = self.df[
-            (self.df["parametro"] == "Silos") & (self.df["asset"] == "Mangime")
-        ].sort_values("data")
-        if not feed_data.empty:
-            fig.add_trace(
-                go.Scatter(
-                    x=feed_data["data"],
-                    y=feed_data["valore"],
-                    mode="lines",
-                    name="Mangime",
-                    line=dict(color=self.colors["feed"], width=3),
-                    fill="tozeroy",
-                    fillcolor="rgba(255, 159, 67, 0.2)",
-                ),
-                row=1,
-                col=1,
-            )
-
-        water_data = self.df[
-            (self.df["parametro"] == "Serbatoio") & (self.df["asset"] == "Acqua")
-        ].sort_values("data")
-        if not water_data.empty:
-            fig.add_trace(
-                go.Scatter(
-                    x=water_data["data"],
-                    y=water_data["valore"],
-                    mode="lines",
-                    name="Acqua",
-                    line=dict(color=self.colors["water"], width=3),
-                    fill="tozeroy",
-                    fillcolor="rgba(252, 92, 125, 0.2)",
-                ),
-                row=1,
-                col=2,
-            )
+        fig.add_trace(
+            go.Scatter(
+                x=[],
+                y=[],
+                mode="lines",
+                name="Mangime",
+                line=dict(color=self.colors["feed"], width=3),
+                fill="tozeroy",
+                fillcolor="rgba(255, 159, 67, 0.2)",
+            ),
+            row=1,
+            col=1,
+        )
+        fig.add_trace(
+            go.Scatter(
+                x=[],
+                y=[],
+                mode="lines",
+                name="Acqua",
+                line=dict(color=self.colors["water"], width=3),
+                fill="tozeroy",
+                fillcolor="rgba(252, 92, 125, 0.2)",
+            ),
+            row=1,
+            col=2,
+        )
 
         fig.update_layout(height=400, **self.default_layout)
         fig.update_xaxes(
-            showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
+            type="date", showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
         )
         fig.update_yaxes(
             showgrid=True,
@@ -167,24 +240,14 @@ class ChartGenerator:
             gridcolor=self.colors["grid"],
             range=[0, 101],
         )
-        return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-
-    def create_temperature_chart(self):
-        """Grafico temperatura migliorato"""
-        temp_data = self.df[
-            (self.df["parametro"] == "Temperatura")
-            & (self.df["asset"] == "Aria")
-        ].sort_values("data")
-        if temp_data.empty:
-            return self._create_empty_chart(
-                "Nessun dato di temperatura disponibile"
-            )
+        return fig
 
+    def _build_temperature_figure(self):
         fig = go.Figure()
         fig.add_trace(
             go.Scatter(
-                x=temp_data["data"],
-                y=temp_data["valore"],
+                x=[],
+                y=[],
                 mode="lines",
                 name="Temperatura",
                 line=dict(color=self.colors["temp"], width=3),
@@ -208,74 +271,47 @@ class ChartGenerator:
             **self.default_layout,
         )
         fig.update_xaxes(
-            showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
+            type="date", showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
         )
         fig.update_yaxes(
             showgrid=True, gridwidth=1, gridcolor=self.colors["grid"]
         )
-        return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+        return fig
 
-    def create_dashboard_summary(self, latest_data):
-        """Crea indicatori KPI con logica migliorata"""
-        kpis = []
-        kpi_config = {
-            "Umidità_Terreno": {
-                "title": "Umidità Terreno",
-                "unit": "%",
-                "thresholds": {"critical": 10, "low": 30, "high": 80},
-                "icon": "💧",
-            },
-            "Umidità_Aria": {
-                "title": "Umidità Aria",
-                "unit": "%",
-                "thresholds": {"critical": None, "low": 50, "high": 70},
-                "icon": "🌫️",
-            },
-            "Silos_Mangime": {
-                "title": "Livello Mangime",
-                "unit": "%",
-                "thresholds": {"critical": 20, "low": 40, "high": None},
-                "icon": "🌾",
-            },
-            "Serbatoio_Acqua": {
-                "title": "Livello Acqua",
-                "unit": "%",
-                "thresholds": {"critical": 20, "low": 40, "high": None},
-                "icon": "💧",
-            },
-            "Temperatura_Aria": {
-                "title": "Temperatura",
-                "unit": "°C",
-                "thresholds": {"critical": None, "low": 20, "high": 30},
-                "icon": "🌡️",
-            },
-        }
+    def create_humidity_chart(self):
+        """Grafico umidità terreno e aria migliorato"""
+        if not any(p == "Umidità" for p, _ in self.series):
+            return self._create_empty_chart("Nessun dato di umidità disponibile")
+        return self._render("humidity")
+
+    def create_resources_chart(self):
+        """Grafico risorse migliorato"""
+        return self._render("resources")
+
+    def create_temperature_chart(self):
+        """Grafico temperatura migliorato"""
+        if self._get_series("Temperatura", "Aria").empty:
+            return self._create_empty_chart(
+                "Nessun dato di temperatura disponibile"
+            )
+        return self._render("temperature")
+
+    def create_dashboard_summary(self, latest_data, version=None, columns=None):
+        """Crea indicatori KPI valutando le regole di kpi_rules sullo snapshot
+
+        Con version (token dei dati) il risultato viene riusato finché non cambia;
+        columns sono le colonne dello snapshot (snapshot['columns']), se disponibili.
+        """
+        rates = rates_per_hour(self.series) if kpi_engine.needs_rates else None
+        return kpi_engine.summary(latest_data, version=version, rates=rates, columns=columns)
 
-        for key, config in kpi_config.items():
-            if key in latest_data:
-                value = latest_data[key]["value"]
-                if isinstance(value, (int, float)):
-                    status = self._determine_status(value, config["thresholds"])
-                    kpis.append(
-                        {
-                            "title": config["title"],
-                            "value": int(value)
-                            if value == int(value)
-                            else round(value, 1),
-                            "unit": config["unit"],
-                            "status": status,
-                            "icon": config["icon"],
-                        }
-                    )
-        return kpis
 
-    def _determine_status(self, value, thresholds):
-        """Determina lo status per la classe CSS"""
-        # La logica qui deve essere precisa per i colori
-        if thresholds.get("critical") is not None and value <= thresholds.get("critical"):
-            return "critical"
-        if thresholds.get("low") is not None and value < thresholds.get("low"):
-            return "low"
-        if thresholds.get("high") is not None and value > thresholds.get("high"):
-            return "high"
-        return "good"
\ No newline at end of file
+def render_charts(df, names, max_points=None, data_only=False, encoding="json"):
+    """Corpo JSON dei grafici names per i dati di df (usabile anche in un altro processo)"""
+    chart_gen = ChartGenerator(
+        df, max_points=max_points, data_only=data_only, encoding=encoding
+    )
+    # I grafici sono già JSON: si annidano come oggetti senza ricodificarli
+    charts = {name: getattr(chart_gen, f"create_{name}_chart")() for name in names}
+    with span("json_encode"):
+        return join_json_object(charts)
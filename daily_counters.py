@@ -0,0 +1,131 @@
+import os
+import json
+import threading
+import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+CHECKPOINT_PATH = os.getenv('DAILY_COUNTERS_CHECKPOINT', '.daily_counters.json')
+
+# Ogni record ON della pompa corrisponde a circa 100 ml
+ML_PER_PUMP_RECORD = 100
+
+# Righe di stato di servo e pompa dall'ultima data già elaborata (compresa: righe con
+# la stessa data possono arrivare dopo; quelle già contate si riconoscono da last_rows)
+STATE_ROWS_QUERY = """
+SELECT asset, valore, data
+FROM Storico
+WHERE parametro = 'Stato'
+AND asset IN ('Servo', 'Pompa')
+AND data >= %s AND data < %s
+ORDER BY data
+"""
+
+
+class DailyCounters:
+    """Aperture servo e record ON pompa di oggi, aggiornati solo con le righe nuove"""
+
+    def __init__(self, checkpoint_path=CHECKPOINT_PATH):
+        self.checkpoint_path = checkpoint_path
+        self._lock = threading.Lock()
+        self._reset(date.today())
+        self._load_checkpoint()
+
+    def _reset(self, day):
+        self.day = day
+        self.last_ts = datetime.combine(day, time.min) - timedelta(microseconds=1)
+        # (asset, valore) delle righe già elaborate con data == last_ts
+        self.last_rows = []
+        self.last_servo = None
+        self.servo_openings = 0
+        self.pump_on_records = 0
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            with open(self.checkpoint_path) as f:
+                state = json.load(f)
+            # Un checkpoint di un altro giorno non serve: si riparte da mezzanotte
+            if state['day'] != self.day.isoformat():
+                return
+            self.last_ts = datetime.fromisoformat(state['last_ts'])
+            if 'last_rows' in state:
+                self.last_rows = [tuple(row) for row in state['last_rows']]
+            else:
+                # Checkpoint precedente: le righe a last_ts erano tutte elaborate
+                self.last_ts += timedelta(microseconds=1)
+            self.last_servo = state['last_servo']
+            self.servo_openings = state['servo_openings']
+            self.pump_on_records = state['pump_on_records']
+        except Exception as e:
+            logging.warning(f"Ignoring daily counters checkpoint: {e}")
+
+    def _save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        state = {
+            'day': self.day.isoformat(),
+            'last_ts': self.last_ts.isoformat(),
+            'last_rows': self.last_rows,
+            'last_servo': self.last_servo,
+            'servo_openings': self.servo_openings,
+            'pump_on_records': self.pump_on_records,
+        }
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.checkpoint_path)
+        except OSError as e:
+            logging.warning(f"Could not write daily counters checkpoint: {e}")
+
+    def update(self, conn):
+        """Elabora le righe arrivate dall'ultimo aggiornamento (reset a mezzanotte)"""
+        with self._lock:
+            today = date.today()
+            if today != self.day:
+                self._reset(today)
+            tomorrow_start = datetime.combine(today, time.min) + timedelta(days=1)
+
+            cursor = conn.cursor()
+            cursor.execute(STATE_ROWS_QUERY, (self.last_ts, tomorrow_start))
+            rows = cursor.fetchall()
+            cursor.close()
+            if not rows:
+                return
+
+            seen = Counter(self.last_rows)
+            for asset, valore, data in rows:
+                if data == self.last_ts and seen[(asset, valore)]:
+                    seen[(asset, valore)] -= 1
+                    continue
+                if asset == 'Servo':
+                    if valore == 'ON' and self.last_servo == 'OFF':
+                        self.servo_openings += 1
+                    self.last_servo = valore
+                elif valore == 'ON':
+                    self.pump_on_records += 1
+            self.last_ts = rows[-1][2]
+            self.last_rows = [(asset, valore) for asset, valore, data in rows
+                              if data == self.last_ts]
+            self._save_checkpoint()
+
+    def statistics(self):
+        """Statistiche nel formato di /api/system-status"""
+        with self._lock:
+            ml_totali = self.pump_on_records * ML_PER_PUMP_RECORD
+            return {
+                'servo': {
+                    'aperture_oggi': self.servo_openings
+                },
+                'pompa': {
+                    'ml_oggi': ml_totali,
+                    'litri_oggi': ml_totali // 1000,
+                    'ml_rimanenti': ml_totali % 1000,
+                    'records_debug': self.pump_on_records  # Per debug
+                }
+            }
+
+
+daily_counters = DailyCounters()
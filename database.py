@@ -1,66 +1,119 @@
-import os
-from dotenv import load_dotenv
 import mysql.connector
 import pandas as pd
 from datetime import datetime, timedelta
 import logging
+from db_pool import get_pool
+from cache import cached
+from sensor_history import sensor_history
+from stream_reader import read_compact, read_downsampled
+from schema import index_report
+from daily_counters import daily_counters, STATE_ROWS_QUERY
+from rollups import choose_resolution, read_rollup, rollup_coverage
+from downsampling import DEFAULT_MAX_POINTS
+from replica import replica
+from kpi_rules import sensor_columns
 
 class FarmDatabase:
-    def __init__(self):
-        load_dotenv()
-        self.config = {
-            'host': os.getenv('DB_HOST'),
-            'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD'),
-            'port': int(os.getenv('DB_PORT', 3306)),
-            'database': os.getenv('DB_NAME'),
-        }
+    def __init__(self, pool=None):
+        self.pool = pool or get_pool()
+        self.config = self.pool.config
         
     def get_connection(self):
         try:
-            return mysql.connector.connect(**self.config)
+            return self.pool.acquire()
         except mysql.connector.Error as err:
             logging.error(f"Database connection error: {err}")
             return None
+
+    def get_read_connection(self, since=None):
+        """Connessione per le letture: la replica locale se aggiornata, altrimenti MySQL
+        
+        Se MySQL non risponde si usa la replica anche oltre il limite di ritardo.
+        """
+        if replica.is_fresh() and replica.covers(since):
+            return replica.connect()
+        conn = self.get_connection()
+        if conn is None and replica.enabled and replica.covers(since):
+            logging.warning("MySQL unavailable, serving reads from stale replica")
+            return replica.connect()
+        return conn
+
+    def get_pool_stats(self):
+        """Metriche del pool di connessioni condiviso"""
+        return self.pool.stats()
     
-    def get_sensor_data(self, hours_back=24):
-        """Recupera dati sensori storici dalle ultime X ore"""
+    @cached('sensor_data')
+    def get_sensor_data(self, hours_back=24, max_points=None, start=None, end=None,
+                        series=None):
+        """Recupera dati sensori storici dalle ultime X ore (o da start a end)
+        
+        series limita la lettura alle coppie (parametro, asset) indicate.
+        Oltre la finestra in memoria si usano i rollup (rollups.py) con la
+        risoluzione più fine che resta entro max_points punti per serie.
+        """
         try:
-            conn = self.get_connection()
+            now = datetime.now()
+            end_time = end or now
+            start_time = start or end_time - timedelta(hours=hours_back)
+            
+            conn = self.get_read_connection(start_time)
             if not conn:
                 return pd.DataFrame()
             
-            query = """
-            SELECT parametro, asset, valore, data
-            FROM Storico 
-            WHERE data >= %s 
-            AND parametro IN ('Umidità', 'Temperatura', 'Silos', 'Serbatoio')
-            ORDER BY data DESC
-            """
-            
-            start_time = datetime.now() - timedelta(hours=hours_back)
-            df = pd.read_sql(query, conn, params=[start_time])
-            conn.close()
-            
-            # Converti la colonna data
-            df['data'] = pd.to_datetime(df['data'])
-            
-            # Converti valore in numerico dove possibile
-            df['valore'] = pd.to_numeric(df['valore'], errors='coerce')
-            
-            # Rimuovi righe con valori NaN (come OFF)
-            df = df.dropna(subset=['valore'])
-            
+            with conn:
+                # Finestra mobile: si leggono solo le righe nuove dall'ultimo refresh
+                if start_time >= now - sensor_history.window:
+                    sensor_history.refresh(conn)
+                    df = None
+                else:
+                    df = self._read_range(conn, start_time, end_time, max_points, series)
+            if df is None:
+                return sensor_history.snapshot(start_time, end, series)
             return df
             
         except Exception as e:
             logging.error(f"Error fetching historical data: {e}")
             return pd.DataFrame()
     
-    def get_latest_values(self):
-        """Recupera i valori più recenti dalla tabella Stato"""
+    def _read_range(self, conn, start_time, end_time, max_points, series):
+        """Dati oltre la finestra in memoria: rollup se disponibili, altrimenti grezzi"""
+        # La replica contiene solo i dati grezzi: i rollup si leggono da MySQL
+        budget = max_points or DEFAULT_MAX_POINTS
+        resolution = choose_resolution(start_time, end_time, budget)
         try:
-            conn = self.get_connection()
+            if not getattr(conn, 'is_replica', False):
+                # I rollup arrivano fino all'ultimo update: la coda si legge dai grezzi
+                covered = rollup_coverage(conn, resolution, end_time)
+                if covered is not None and covered > start_time:
+                    df = read_rollup(conn, resolution, start_time, covered, series)
+                    if not df.empty:
+                        if covered < end_time:
+                            # Stessa densità di punti del resto dell'intervallo
+                            share = (end_time - covered) / (end_time - start_time)
+                            tail_points = 0 if max_points == 0 else max(int(budget * share), 2)
+                            tail = self._read_raw(conn, covered, end_time, tail_points, series)
+                            df = pd.concat([tail, df], ignore_index=True)
+                        return df
+                elif covered is not None:
+                    logging.info(f"Rollup {resolution} behind {start_time}, reading raw data")
+        except mysql.connector.Error as err:
+            logging.warning(f"Rollup {resolution} unavailable, reading raw data: {err}")
+        
+        return self._read_raw(conn, start_time, end_time, max_points, series)
+    
+    def _read_raw(self, conn, start_time, end_time, max_points, series):
+        # Lettura in streaming a blocchi: memoria limitata anche su intervalli lunghi
+        if max_points == 0:
+            return read_compact(conn, start_time, end_time, series)
+        return read_downsampled(
+            conn, start_time, end_time, series, max_points or DEFAULT_MAX_POINTS
+        )
+    
+    @cached('stato_snapshot')
+    def get_stato_snapshot(self):
+        """Legge in un solo round trip i valori dei sensori e lo stato dei sistemi da Stato"""
+        try:
+            conn = self.get_read_connection()
             if not conn:
                 return {}
             
@@ -68,137 +121,71 @@ class FarmDatabase:
             SELECT parametro, asset, valore, data
             FROM Stato
             WHERE parametro IN ('Umidità', 'Temperatura', 'Silos', 'Serbatoio')
+            OR (parametro = 'Stato' AND asset IN ('Pompa', 'Servo'))
             """
             
-            df = pd.read_sql(query, conn)
-            conn.close()
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute(query)
+                rows = cursor.fetchall()
             
-            # Organizza i dati per asset
-            latest_data = {}
-            for _, row in df.iterrows():
+            # Un solo passaggio sulle righe per entrambi i dizionari
+            sensors = {}
+            systems = {}
+            for parametro, asset, valore, data in rows:
+                key = f"{parametro}_{asset}"
+                if parametro == 'Stato':
+                    systems[key] = {
+                        'value': valore,
+                        'timestamp': data,
+                        'status': 'active' if valore == 'ON' else 'inactive'
+                    }
+                    continue
                 # Gestisci valori numerici e stringhe
                 try:
-                    value = float(row['valore'])
+                    value = float(valore)
                 except (ValueError, TypeError):
-                    value = row['valore']  # Mantieni come stringa se non numerico
-                
-                key = f"{row['parametro']}_{row['asset']}"
-                latest_data[key] = {
+                    value = valore  # Mantieni come stringa se non numerico
+                sensors[key] = {
                     'value': value,
-                    'timestamp': row['data']
+                    'timestamp': data
                 }
             
-            return latest_data
+            # Forma colonnare per kpi_rules, costruita una volta per lettura e non a ogni
+            # valutazione delle regole
+            return {'sensors': sensors, 'systems': systems, 'columns': sensor_columns(sensors)}
             
         except Exception as e:
-            logging.error(f"Error fetching latest data: {e}")
+            logging.error(f"Error fetching Stato snapshot: {e}")
             return {}
     
+    def get_latest_values(self):
+        """Recupera i valori più recenti dalla tabella Stato"""
+        return self.get_stato_snapshot().get('sensors', {})
+    
     def get_system_status(self):
         """Recupera lo stato attuale dei sistemi"""
-        try:
-            conn = self.get_connection()
-            if not conn:
-                return {}
-            
-            query = """
-            SELECT parametro, asset, valore, data
-            FROM Stato
-            WHERE parametro = 'Stato'
-            AND asset IN ('Pompa', 'Servo')
-            """
-            
-            df = pd.read_sql(query, conn)
-            conn.close()
-            
-            status_data = {}
-            for _, row in df.iterrows():
-                key = f"{row['parametro']}_{row['asset']}"
-                status_data[key] = {
-                    'value': row['valore'],
-                    'timestamp': row['data'],
-                    'status': 'active' if row['valore'] == 'ON' else 'inactive'
-                }
-            
-            return status_data
-            
-        except Exception as e:
-            logging.error(f"Error fetching system status: {e}")
-            return {}
+        return self.get_stato_snapshot().get('systems', {})
 
+    @cached('system_statistics')
     def get_system_statistics(self):
         """Recupera statistiche avanzate dei sistemi"""
         try:
-            conn = self.get_connection()
+            conn = self.get_read_connection()
             if not conn:
                 return {
                     'servo': {'aperture_oggi': 0},
                     'pompa': {'ml_oggi': 0, 'litri_oggi': 0}
                 }
             
-            cursor = conn.cursor(dictionary=True)
-            
-            # Query servo - conta transizioni OFF -> ON (semplificata)
-            servo_query = """
-            SELECT 
-                SUM(CASE 
-                    WHEN valore = 'ON' AND 
-                        LAG(valore) OVER (ORDER BY data) = 'OFF' 
-                    THEN 1 ELSE 0 
-                END) as aperture_oggi
-            FROM Storico 
-            WHERE parametro = 'Stato' 
-            AND asset = 'Servo'
-            AND DATE(data) = CURDATE()
-            ORDER BY data
-            """
-            
-            # Query pompa - conta tutti i record ON oggi
-            pump_query = """
-            SELECT COUNT(*) as records_on
-            FROM Storico 
-            WHERE parametro = 'Stato' 
-            AND asset = 'Pompa'
-            AND valore = 'ON'
-            AND DATE(data) = CURDATE()
-            """
-            
-            # Esegui query servo
-            try:
-                cursor.execute(servo_query)
-                servo_result = cursor.fetchone()
-                aperture_oggi = int(servo_result['aperture_oggi'] or 0)
-            except Exception as e:
-                logging.warning(f"Servo query error: {e}")
-                aperture_oggi = 0
-            
-            # Esegui query pompa  
-            try:
-                cursor.execute(pump_query)
-                pump_result = cursor.fetchone()
-                records_on = int(pump_result['records_on'] or 0)
-            except Exception as e:
-                logging.warning(f"Pump query error: {e}")
-                records_on = 0
-            
-            conn.close()
-            
-            # Calcola millilitri (ogni record ON = ~100ml approssimato)
-            ml_totali = records_on * 100
-            litri_totali = ml_totali // 1000
-            ml_rimanenti = ml_totali % 1000
+            # Contatori giornalieri incrementali: si leggono solo le righe nuove
+            with conn:
+                try:
+                    daily_counters.update(conn)
+                except Exception as e:
+                    logging.warning(f"Daily counters update error: {e}")
             
-            return {
-                'servo': {
-                    'aperture_oggi': aperture_oggi
-                },
-                'pompa': {
-                    'ml_oggi': ml_totali,
-                    'litri_oggi': litri_totali,
-                    'ml_rimanenti': ml_rimanenti,
-                    'records_debug': records_on  # Per debug
-                }
-            }
+            return daily_counters.statistics()
             
         except Exception as e:
             logging.error(f"Error fetching system statistics: {e}")
@@ -207,6 +194,31 @@ class FarmDatabase:
                 'pompa': {'ml_oggi': 0, 'litri_oggi': 0, 'ml_rimanenti': 0}
             }
 
+    @cached('watermarks')
+    def get_latest_timestamps(self):
+        """Data più recente in Stato e Storico, per rilevare dati nuovi"""
+        try:
+            # Con la replica attiva i dati nuovi sono quelli già copiati in locale
+            if replica.is_fresh():
+                return replica.watermarks()
+            
+            conn = self.get_connection()
+            if not conn:
+                return {}
+            
+            with conn:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("""
+                SELECT (SELECT MAX(data) FROM Stato) AS stato,
+                       (SELECT MAX(data) FROM Storico) AS storico
+                """)
+                result = cursor.fetchone()
+            return result or {}
+            
+        except Exception as e:
+            logging.error(f"Error fetching latest timestamps: {e}")
+            return {}
+
     def test_connection(self):
         """Testa la connessione al database"""
         try:
@@ -226,27 +238,40 @@ class FarmDatabase:
             if not conn:
                 return {}
             
-            cursor = conn.cursor(dictionary=True)
+            with conn:
+                cursor = conn.cursor(dictionary=True)
             
-            # Conta record per tabella
-            queries = {
-                'storico_count': "SELECT COUNT(*) as count FROM Storico",
-                'stato_count': "SELECT COUNT(*) as count FROM Stato",
-                'latest_storico': "SELECT MAX(data) as latest FROM Storico",
-                'latest_stato': "SELECT MAX(data) as latest FROM Stato"
-            }
+                # Conta record per tabella
+                queries = {
+                    'storico_count': "SELECT COUNT(*) as count FROM Storico",
+                    'stato_count': "SELECT COUNT(*) as count FROM Stato",
+                    'latest_storico': "SELECT MAX(data) as latest FROM Storico",
+                    'latest_stato': "SELECT MAX(data) as latest FROM Stato"
+                }
+            
+                info = {}
+                for key, query in queries.items():
+                    try:
+                        cursor.execute(query)
+                        result = cursor.fetchone()
+                        info[key] = result
+                    except Exception as e:
+                        logging.warning(f"Error in query {key}: {e}")
+                        info[key] = None
             
-            info = {}
-            for key, query in queries.items():
+                # Verifica indici e piano di esecuzione della query dei contatori giornalieri
                 try:
-                    cursor.execute(query)
-                    result = cursor.fetchone()
-                    info[key] = result
+                    info['schema'] = index_report(cursor, {
+                        'daily_state_rows': (
+                            STATE_ROWS_QUERY,
+                            (daily_counters.last_ts, datetime.now() + timedelta(days=1))
+                        ),
+                    })
                 except Exception as e:
-                    logging.warning(f"Error in query {key}: {e}")
-                    info[key] = None
+                    logging.warning(f"Error checking indexes: {e}")
+                    info['schema'] = None
             
-            conn.close()
+            info['replica'] = replica.stats()
             return info
             
         except Exception as e:
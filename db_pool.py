@@ -0,0 +1,218 @@
+import os
+import queue
+import threading
+import time
+import logging
+from dotenv import load_dotenv
+import mysql.connector
+from metrics import span
+
+
+class TimedCursor:
+    """Cursore che misura esecuzione e lettura delle query (span db_query)"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, *args, **kwargs):
+        with span('db_query'):
+            return self._cursor.execute(*args, **kwargs)
+
+    def fetchone(self):
+        with span('db_query'):
+            return self._cursor.fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with span('db_query'):
+            return self._cursor.fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with span('db_query'):
+            return self._cursor.fetchall()
+
+
+class PooledConnection:
+    """Connessione presa in prestito dal pool: close() la restituisce al pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs))
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Pool di connessioni MySQL condiviso da tutto il processo"""
+
+    def __init__(self, config, size=5, timeout=10.0):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._borrows = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _new_connection(self):
+        # autocommit evita che una connessione riusata resti su uno snapshot vecchio
+        return mysql.connector.connect(autocommit=True, **self.config)
+
+    def _is_healthy(self, conn):
+        try:
+            conn.ping(reconnect=True, attempts=1, delay=0)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Prende una connessione verificata dal pool, aspettando se esaurito"""
+        with span('db_connect'):
+            return self._acquire()
+
+    def _acquire(self):
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        while True:
+            conn = None
+            create = False
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._created < self.size:
+                        self._created += 1
+                        create = True
+                if not create:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        with self._lock:
+                            self._timeouts += 1
+                        raise mysql.connector.errors.PoolError(
+                            f"No connection available within {self.timeout}s"
+                        )
+                    try:
+                        conn = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+
+            if create:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            elif not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+
+            waited = time.perf_counter() - start
+            with self._lock:
+                self._in_use += 1
+                self._borrows += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return PooledConnection(self, conn)
+
+    def release(self, conn):
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+            self._discarded += 1
+
+    def stats(self):
+        """Metriche del pool: connessioni in uso, attese in prestito, ecc."""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'borrows': self._borrows,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'wait_avg_ms': round(self._wait_total / self._borrows * 1000, 3)
+                if self._borrows else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def load_db_config():
+    """Legge la configurazione del database dalle variabili d'ambiente"""
+    load_dotenv()
+    return {
+        'host': os.getenv('DB_HOST'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'port': int(os.getenv('DB_PORT', 3306)),
+        'database': os.getenv('DB_NAME'),
+    }
+
+
+def init_pool(size=None, timeout=None):
+    """Crea il pool di processo (una sola volta) e lo restituisce"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = load_db_config()
+            size = size or int(os.getenv('DB_POOL_SIZE', 5))
+            timeout = timeout or float(os.getenv('DB_POOL_TIMEOUT', 10))
+            _pool = ConnectionPool(config, size=size, timeout=timeout)
+            logging.info(f"MySQL connection pool ready (size={size})")
+        return _pool
+
+
+def get_pool():
+    return _pool if _pool is not None else init_pool()
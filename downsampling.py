@@ -0,0 +1,95 @@
+import os
+import numpy as np
+
+DEFAULT_MAX_POINTS = int(os.getenv('DOWNSAMPLE_MAX_POINTS', 1000))
+DEFAULT_METHOD = os.getenv('DOWNSAMPLE_METHOD', 'lttb')
+
+
+def _as_float(x):
+    """Asse x come float64 (le date diventano nanosecondi epoch)"""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def _bucket_edges(n, n_buckets):
+    # Primo e ultimo punto restano fuori dai bucket e vengono sempre tenuti
+    return np.linspace(1, n - 1, n_buckets + 1).astype(np.int64)
+
+
+def lttb_indices(x, y, n_out):
+    """Indici scelti con Largest-Triangle-Three-Buckets"""
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        # Nessun bucket possibile: solo gli estremi, l'ultimo punto per primo
+        return np.array([0, n - 1])[-n_out:]
+
+    xf = _as_float(x)
+    yf = np.asarray(y, dtype=np.float64)
+    edges = _bucket_edges(n, n_out - 2)
+
+    # Media di ogni bucket calcolata in blocco: serve come terzo vertice
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+    avg_x = np.add.reduceat(xf, starts) / counts
+    avg_y = np.add.reduceat(yf, starts) / counts
+    avg_x = np.append(avg_x[1:], xf[-1])
+    avg_y = np.append(avg_y[1:], yf[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = starts[i], ends[i]
+        bx = xf[lo:hi]
+        by = yf[lo:hi]
+        area = np.abs(
+            (xf[a] - avg_x[i]) * (by - yf[a]) - (xf[a] - bx) * (avg_y[i] - yf[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(x, y, n_out):
+    """Indici di minimo e massimo per ogni bucket (n_out / 2 bucket)"""
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 4:
+        # Serve almeno un bucket (min e max) oltre agli estremi per restare nel budget
+        return lttb_indices(x, y, n_out)
+    n_buckets = (n_out - 2) // 2
+
+    yf = np.asarray(y, dtype=np.float64)
+    edges = _bucket_edges(n, n_buckets)
+    # Con i bucket di lunghezza quasi uguale si può lavorare su una matrice
+    width = int((edges[1:] - edges[:-1]).max())
+    pos = edges[:-1, None] + np.arange(width)[None, :]
+    valid = pos < edges[1:, None]
+    pos = np.where(valid, pos, edges[1:, None] - 1)
+    values = yf[pos]
+    idx_min = pos[np.arange(n_buckets), np.argmin(np.where(valid, values, np.inf), axis=1)]
+    idx_max = pos[np.arange(n_buckets), np.argmax(np.where(valid, values, -np.inf), axis=1)]
+
+    selected = np.concatenate(([0], idx_min, idx_max, [n - 1]))
+    return np.unique(selected)
+
+
+METHODS = {
+    'lttb': lttb_indices,
+    'minmax': minmax_indices,
+}
+
+
+def downsample(x, y, max_points=None, method=None):
+    """Riduce una serie a max_points punti preservandone la forma"""
+    max_points = DEFAULT_MAX_POINTS if max_points is None else max_points
+    if not max_points or len(y) <= max_points:
+        return x, y
+    indices = METHODS[method or DEFAULT_METHOD](x, y, max_points)
+    return np.asarray(x)[indices], np.asarray(y)[indices]
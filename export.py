@@ -0,0 +1,253 @@
+"""Esportazione in streaming dello storico sensori in CSV, Parquet o Arrow IPC
+
+Uso: python export.py --from 2024-01-01 --to 2024-03-01 --format parquet -o storico.parquet
+"""
+import io
+import os
+import csv
+import sys
+import argparse
+import threading
+import logging
+from datetime import datetime
+import numpy as np
+import mysql.connector
+from stream_reader import iter_rows
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+COLUMNS = ('parametro', 'asset', 'valore', 'data')
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+# Le esportazioni usano connessioni dedicate: un limite evita di saturare MySQL
+_export_slots = threading.BoundedSemaphore(int(os.getenv('EXPORT_MAX_CONCURRENT', 2)))
+
+
+class ExportBusy(Exception):
+    pass
+
+
+class ExportUnavailable(Exception):
+    pass
+
+
+def parse_series(assets):
+    """?assets=Umidità_Terreno,Temperatura_Aria -> ((parametro, asset), ...)"""
+    if not assets:
+        return None
+    series = []
+    for token in assets.split(','):
+        parametro, sep, asset = token.strip().partition('_')
+        if not sep or not asset:
+            raise ValueError(f"Invalid asset '{token}', expected parametro_asset")
+        series.append((parametro, asset))
+    return tuple(series)
+
+
+def parse_columns(columns):
+    if not columns:
+        return COLUMNS
+    selected = tuple(c.strip() for c in columns.split(',') if c.strip())
+    unknown = set(selected) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+    return selected
+
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if fmt != 'csv' and pa is None:
+        raise ValueError(f"Format '{fmt}' requires pyarrow")
+
+
+def _row_columns(rows, columns):
+    """Colonne richieste di un blocco di righe; data come datetime64[ms]"""
+    fields = dict(zip(COLUMNS, zip(*rows)))
+    data = {}
+    for column in columns:
+        if column == 'data':
+            data[column] = np.array(fields[column], dtype='datetime64[ms]')
+        elif column == 'valore':
+            # Testo originale: niente arrotondamenti e anche i valori non numerici
+            data[column] = [v if isinstance(v, str) else str(v) for v in fields[column]]
+        else:
+            data[column] = fields[column]
+    return data
+
+
+def _csv_chunks(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    for rows in chunks:
+        data = _row_columns(rows, columns)
+        if 'data' in data:
+            data['data'] = np.datetime_as_string(data['data'], unit='ms').tolist()
+        writer.writerows(zip(*(data[column] for column in columns)))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class _DrainSink(io.RawIOBase):
+    """File in sola scrittura che accumula i byte fino al prossimo drain()"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema(columns):
+    types = {
+        'parametro': pa.dictionary(pa.int16(), pa.string()),
+        'asset': pa.dictionary(pa.int16(), pa.string()),
+        'valore': pa.string(),
+        'data': pa.timestamp('ms'),
+    }
+    return pa.schema([(column, types[column]) for column in columns])
+
+
+def _record_batch(rows, columns, schema):
+    data = _row_columns(rows, columns)
+    arrays = []
+    for column in columns:
+        if column in ('parametro', 'asset'):
+            arrays.append(pa.array(data[column], type=pa.string()).dictionary_encode()
+                          .cast(schema.field(column).type))
+        else:
+            arrays.append(pa.array(data[column], type=schema.field(column).type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _arrow_chunks(chunks, columns, fmt):
+    schema = _arrow_schema(columns)
+    sink = _DrainSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        write = lambda batch: writer.write_batch(batch)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+    try:
+        for rows in chunks:
+            # Ogni blocco diventa un record batch (o row group) e viene inviato subito
+            write(_record_batch(rows, columns, schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+class _ExportStream:
+    """Iterabile della risposta: chiude la connessione e libera lo slot anche se non
+    viene mai consumato (un generatore mai avviato non esegue il suo finally)"""
+
+    def __init__(self, conn, start, end, fmt, columns, series):
+        self._conn = conn
+        self._generator = self._generate(conn, start, end, fmt, columns, series)
+        self._released = False
+
+    def _release(self):
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._conn.close()
+        except Exception as e:
+            logging.warning(f"Error closing export connection: {e}")
+        finally:
+            _export_slots.release()
+
+    def _generate(self, conn, start, end, fmt, columns, series):
+        try:
+            chunks = iter_rows(conn, start, end, series)
+            if fmt == 'csv':
+                yield from _csv_chunks(chunks, columns)
+            else:
+                yield from _arrow_chunks(chunks, columns, fmt)
+        except Exception as e:
+            logging.error(f"Error exporting sensor history: {e}")
+            raise
+        finally:
+            self._release()
+
+    def __iter__(self):
+        return self._generator
+
+    def close(self):
+        self._generator.close()
+        self._release()
+
+
+def export_stream(config, start, end, fmt='csv', columns=COLUMNS, series=None):
+    """Iterabile di byte dell'esportazione; usa una connessione dedicata
+
+    La connessione si apre qui, prima della risposta: se MySQL non è raggiungibile
+    il chiamante riceve ExportUnavailable invece di un 200 troncato.
+    """
+    check_format(fmt)
+    if not _export_slots.acquire(blocking=False):
+        raise ExportBusy("Too many exports in progress")
+    try:
+        # Connessione fuori dal pool: un export lungo non toglie posti alla dashboard
+        conn = mysql.connector.connect(**config)
+    except mysql.connector.Error as e:
+        _export_slots.release()
+        logging.error(f"Error opening export connection: {e}")
+        raise ExportUnavailable(f"Database unavailable: {e}")
+    return _ExportStream(conn, start, end, fmt, columns, series)
+
+
+if __name__ == '__main__':
+    from db_pool import load_db_config
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--from', dest='start', required=True, type=datetime.fromisoformat)
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat, default=datetime.now())
+    parser.add_argument('--format', default='csv', choices=list(FORMATS))
+    parser.add_argument('--columns', help='es. data,valore')
+    parser.add_argument('--assets', help='es. Umidità_Terreno,Temperatura_Aria')
+    parser.add_argument('-o', '--output', help='file di destinazione (default: stdout)')
+    args = parser.parse_args()
+
+    stream = export_stream(
+        load_db_config(), args.start, args.end, args.format,
+        parse_columns(args.columns), parse_series(args.assets),
+    )
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for block in stream:
+            out.write(block)
+    finally:
+        stream.close()
+        if args.output:
+            out.close()
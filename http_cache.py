@@ -0,0 +1,88 @@
+import gzip
+import hashlib
+import logging
+from datetime import date
+from functools import wraps
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/css', 'application/javascript')
+
+
+def make_etag(*parts):
+    """Valore di ETag derivato da watermark dei dati e parametri della richiesta"""
+    return hashlib.blake2b(
+        '|'.join(str(part) for part in parts).encode(), digest_size=12
+    ).hexdigest()
+
+
+def conditional(version):
+    """Risponde 304 se If-None-Match coincide, prima di eseguire la view
+
+    version() restituisce il token dei dati (es. MAX(data) di Stato/Storico).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                token = version()
+            except Exception as e:
+                logging.warning(f"Version token unavailable: {e}")
+                token = None
+            if not token:
+                return view(*args, **kwargs)
+
+            etag = make_etag(
+                token, date.today(), request.path, sorted(request.args.items(multi=True))
+            )
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            # Le risposte di errore non devono essere riusate dal client
+            if response.status_code == 200 and b'"error"' not in response.get_data()[:20]:
+                response.set_etag(etag, weak=True)
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def compress_response(response):
+    """Comprime con brotli o gzip le risposte testuali grandi (hook after_request)"""
+    if (
+        response.is_streamed
+        or response.direct_passthrough
+        or response.status_code != 200
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_TYPES
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    data, encoding = compress_body(data, request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_body(data, accepted):
+    """Comprime data secondo Accept-Encoding: (byte, codifica) o (data, None)"""
+    if brotli is not None and accepted['br']:
+        return brotli.compress(data, quality=5), 'br'
+    if accepted['gzip']:
+        return gzip.compress(data, compresslevel=5), 'gzip'
+    return data, None
@@ -0,0 +1,210 @@
+"""Regole KPI configurabili, valutate in modo vettoriale su tutto lo snapshot di Stato
+
+Le regole si leggono da KPI_RULES_FILE (JSON, lista di oggetti come DEFAULT_RULES)
+oppure si usano quelle predefinite. asset "*" vale per tutti gli asset di quel
+parametro senza una regola propria (es. più stalle con gli stessi sensori).
+
+Campi di una regola: parametro, asset, title, unit, icon, soglie critical/low/high,
+max_rate (variazione massima per ora nella finestra recente) e stale_after
+(secondi senza aggiornamenti oltre i quali il sensore è considerato fermo).
+"""
+import os
+import json
+import math
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+KPI_RULES_FILE = os.getenv('KPI_RULES_FILE', '')
+# Soglia di inattività predefinita per le regole che non la indicano (0 = disattivata)
+KPI_STALE_AFTER = float(os.getenv('KPI_STALE_AFTER', 0))
+
+DEFAULT_RULES = [
+    {'parametro': 'Umidità', 'asset': 'Terreno', 'title': 'Umidità Terreno', 'unit': '%',
+     'icon': '💧', 'critical': 10, 'low': 30, 'high': 80},
+    {'parametro': 'Umidità', 'asset': 'Aria', 'title': 'Umidità Aria', 'unit': '%',
+     'icon': '🌫️', 'critical': None, 'low': 50, 'high': 70},
+    {'parametro': 'Silos', 'asset': 'Mangime', 'title': 'Livello Mangime', 'unit': '%',
+     'icon': '🌾', 'critical': 20, 'low': 40, 'high': None},
+    {'parametro': 'Serbatoio', 'asset': 'Acqua', 'title': 'Livello Acqua', 'unit': '%',
+     'icon': '💧', 'critical': 20, 'low': 40, 'high': None},
+    {'parametro': 'Temperatura', 'asset': 'Aria', 'title': 'Temperatura', 'unit': '°C',
+     'icon': '🌡️', 'critical': None, 'low': 20, 'high': 30},
+]
+
+# Indice = priorità: a parità di condizioni vince lo stato più a destra
+STATUS_NAMES = ('good', 'high', 'low', 'unstable', 'critical', 'stale')
+GOOD, HIGH, LOW, UNSTABLE, CRITICAL, STALE = range(len(STATUS_NAMES))
+
+
+def _threshold(value):
+    return np.nan if value is None else float(value)
+
+
+def load_rules(path=KPI_RULES_FILE):
+    """Regole da file JSON, o quelle predefinite se il file non è indicato o non è valido"""
+    if not path:
+        return DEFAULT_RULES
+    try:
+        with open(path, encoding='utf-8') as f:
+            rules = json.load(f)
+        for rule in rules:
+            missing = {'parametro', 'asset', 'title'} - set(rule)
+            if missing:
+                raise ValueError(f"rule without {', '.join(sorted(missing))}: {rule}")
+        return rules
+    except Exception as e:
+        logging.error(f"Invalid KPI rules file {path}, using defaults: {e}")
+        return DEFAULT_RULES
+
+
+class KpiRuleEngine:
+    """Valuta tutte le regole in un colpo solo con NumPy e ricorda l'ultimo risultato"""
+
+    def __init__(self, rules=None, stale_after=KPI_STALE_AFTER):
+        rules = load_rules() if rules is None else rules
+        self.rules = rules
+        self._exact = {}
+        self._wildcard = {}
+        for i, rule in enumerate(rules):
+            if rule['asset'] == '*':
+                self._wildcard[rule['parametro']] = i
+            else:
+                self._exact[f"{rule['parametro']}_{rule['asset']}"] = i
+        self.critical = np.array([_threshold(r.get('critical')) for r in rules])
+        self.low = np.array([_threshold(r.get('low')) for r in rules])
+        self.high = np.array([_threshold(r.get('high')) for r in rules])
+        self.max_rate = np.array([_threshold(r.get('max_rate')) for r in rules])
+        self.stale_after = np.array([
+            _threshold(r.get('stale_after', stale_after or None)) for r in rules
+        ])
+        self.needs_rates = bool(np.isfinite(self.max_rate).any())
+        self.needs_timestamps = bool(np.isfinite(self.stale_after).any())
+        self._index = None
+        self._cached = None
+
+    def _match(self, keys):
+        """Regola e testi del KPI per ogni chiave, ricalcolati solo se cambiano le chiavi"""
+        index = self._index
+        if index is not None and index[0] == keys:
+            return index[1], index[2]
+        rule_idx = np.empty(len(keys), dtype=np.int64)
+        labels = []
+        for i, key in enumerate(keys):
+            parametro, _, asset = key.partition('_')
+            idx = self._exact.get(key, self._wildcard.get(parametro, -1))
+            rule_idx[i] = idx
+            rule = self.rules[idx] if idx >= 0 else None
+            if rule is None:
+                labels.append(None)
+                continue
+            title = rule['title'] if rule['asset'] != '*' else f"{rule['title']} {asset}"
+            labels.append((title, rule.get('unit', ''), rule.get('icon', '')))
+        self._index = (keys, rule_idx, labels)
+        return rule_idx, labels
+
+    def evaluate(self, sensors, rates=None, now=None, columns=None):
+        """Lista di KPI per i sensori con una regola e un valore numerico
+
+        columns è la forma colonnare dello snapshot (vedi sensor_columns): se manca
+        viene ricavata da sensors. Restituisce anche l'istante fino al quale il
+        risultato resta valido (il primo sensore che diventerà fermo), o None se non scade.
+        """
+        keys, values, timestamps = columns if columns is not None else sensor_columns(sensors)
+        rule_idx, labels = self._match(keys)
+        rows = np.flatnonzero((rule_idx >= 0) & ~np.isnan(values))
+        if not len(rows):
+            return [], None
+        # Ordine delle regole, poi quello dello snapshot
+        rows = rows[np.argsort(rule_idx[rows], kind='stable')]
+        r = rule_idx[rows]
+        v = values[rows]
+
+        status = np.full(len(rows), GOOD, dtype=np.int8)
+        status[v > self.high[r]] = HIGH
+        status[v < self.low[r]] = LOW
+        if self.needs_rates and rates:
+            # dict.get restituisce None per le chiavi senza serie, che diventa NaN
+            rate = np.array(list(map(rates.get, keys)), dtype=np.float64)[rows]
+            status[np.abs(rate) > self.max_rate[r]] = UNSTABLE
+        status[v <= self.critical[r]] = CRITICAL
+
+        valid_until = None
+        if self.needs_timestamps:
+            now = now or datetime.now()
+            age = (np.datetime64(now, 'ns') - timestamps[rows]) / np.timedelta64(1, 's')
+            limit = self.stale_after[r]
+            stale = age > limit
+            status[stale] = STALE
+            # Il risultato cambia quando il prossimo sensore supera il limite
+            remaining = (limit - age)[~stale]
+            remaining = remaining[np.isfinite(remaining)]
+            if len(remaining):
+                valid_until = now.timestamp() + float(remaining.min())
+
+        integral = (v == np.trunc(v)).tolist()
+        rounded = np.round(v, 1).tolist()
+        return [
+            {
+                'title': title,
+                'value': int(value) if whole else value,
+                'unit': unit,
+                'status': STATUS_NAMES[code],
+                'icon': icon,
+            }
+            for (title, unit, icon), value, whole, code in zip(
+                map(labels.__getitem__, rows.tolist()), rounded, integral, status.tolist()
+            )
+        ], valid_until
+
+    def summary(self, sensors, version=None, rates=None, columns=None):
+        """Come evaluate, ma riusa il risultato finché la versione dei dati non cambia
+
+        Uno snapshot vuoto (di solito una lettura di Stato fallita) non viene ricordato,
+        così la chiamata successiva per la stessa versione riprova.
+        """
+        now = datetime.now()
+        cached = self._cached
+        if (version is not None and cached is not None and cached[0] == version
+                and (cached[1] is None or now.timestamp() < cached[1])):
+            return cached[2]
+        kpis, valid_until = self.evaluate(sensors, rates, now, columns)
+        if version is not None and sensors:
+            self._cached = (version, valid_until, kpis)
+        return kpis
+
+
+def sensor_columns(sensors):
+    """Snapshot {chiave: {'value', 'timestamp'}} in colonne (chiavi, valori, istanti)
+
+    I valori non numerici diventano NaN. get_stato_snapshot le calcola una volta per
+    lettura e le mette nello snapshot come 'columns'.
+    """
+    keys = tuple(sensors)
+    entries = sensors.values()
+    values = np.array([
+        e['value'] if isinstance(e['value'], (int, float)) else np.nan for e in entries
+    ], dtype=np.float64)
+    # DatetimeIndex converte le datetime molto più in fretta di np.array
+    timestamps = pd.DatetimeIndex(
+        [e['timestamp'] for e in entries]
+    ).to_numpy(dtype='datetime64[ns]')
+    return keys, values, timestamps
+
+def rates_per_hour(series):
+    """Variazione oraria tra il primo e l'ultimo punto di ogni serie {(parametro, asset): df}"""
+    rates = {}
+    for (parametro, asset), part in series.items():
+        if len(part) < 2:
+            continue
+        dates = part['data']
+        hours = (dates.iat[-1] - dates.iat[0]).total_seconds() / 3600
+        if hours > 0:
+            rate = (part['valore'].iat[-1] - part['valore'].iat[0]) / hours
+            if not math.isnan(rate):
+                rates[f"{parametro}_{asset}"] = rate
+    return rates
+
+
+kpi_engine = KpiRuleEngine()
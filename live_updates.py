@@ -0,0 +1,140 @@
+import os
+import json
+import queue
+import threading
+import logging
+import pandas as pd
+from database import FarmDatabase
+from chart_generator import ChartGenerator
+from chart_encoding import dates_to_epoch_ms
+from sensor_history import sensor_history
+from cache import cache, DATA_FAMILIES
+from kpi_rules import kpi_engine
+
+POLL_INTERVAL = float(os.getenv('LIVE_POLL_INTERVAL', 5))
+HEARTBEAT_INTERVAL = float(os.getenv('LIVE_HEARTBEAT_INTERVAL', 15))
+CLIENT_QUEUE_SIZE = 32
+
+
+class LiveWatcher:
+    """Un solo thread controlla il DB e distribuisce i delta a tutti i client SSE"""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.dumps = json.dumps
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._watermarks = None
+        self._last_points = None
+
+    def subscribe(self, client=None):
+        """Registra un client: qualsiasi oggetto con put_nowait, di default una coda"""
+        if client is None:
+            client = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(client)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, name='live-watcher', daemon=True
+                )
+                self._thread.start()
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+
+    def _is_subscribed(self, client):
+        with self._lock:
+            return client in self._subscribers
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stop(self):
+        self._stop.set()
+
+    def publish(self, event, payload):
+        message = f"event: {event}\ndata: {self.dumps(payload)}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for client in subscribers:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # Client troppo lento: lo si scollega, si riconnetterà da solo
+                logging.warning("Dropping slow live-update client")
+                self.unsubscribe(client)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            if not self.subscriber_count():
+                continue
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Live watcher error: {e}")
+
+    def check(self):
+        """Controlla MAX(data) e, se ci sono dati nuovi, pubblica i delta"""
+        db = FarmDatabase()
+        watermarks = db.get_latest_timestamps()
+        if not watermarks or watermarks == self._watermarks:
+            return
+        first = self._watermarks is None
+        self._watermarks = watermarks
+
+        # I dati sono cambiati: le voci in cache non sono più valide
+        for family in DATA_FAMILIES:
+            cache.invalidate(family)
+        if first:
+            return
+
+        snapshot = db.get_stato_snapshot()
+        # Stessa finestra di /api/kpis, così le regole max_rate valgono anche via SSE
+        history = db.get_sensor_data(hours_back=1) if kpi_engine.needs_rates else pd.DataFrame()
+        update = {
+            'kpis': ChartGenerator(history).create_dashboard_summary(
+                snapshot.get('sensors', {}), columns=snapshot.get('columns')
+            ),
+            'systems': {
+                'status': snapshot.get('systems', {}),
+                'statistics': db.get_system_statistics(),
+            },
+            'points': self._new_points(db),
+        }
+        self.publish('update', update)
+
+    def _new_points(self, db):
+        """Punti arrivati dall'ultimo controllo, per Plotly.extendTraces"""
+        previous = self._last_points or sensor_history.last_seen
+        db.get_sensor_data(hours_back=sensor_history.window_hours)
+        self._last_points = sensor_history.last_seen
+        if previous is None:
+            return {}
+        return {
+            f"{parametro}_{asset}": {
+                'x': dates_to_epoch_ms(part['data'].to_numpy()),
+                'y': part['valore'].tolist(),
+            }
+            for (parametro, asset), part in sensor_history.since(previous).items()
+        }
+
+    def stream(self, client):
+        """Generatore SSE per un client, con heartbeat periodico"""
+        try:
+            yield "retry: 5000\n\n"
+            while self._is_subscribed(client):
+                try:
+                    yield client.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(client)
+
+
+live_watcher = LiveWatcher()
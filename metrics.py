@@ -0,0 +1,225 @@
+"""Metriche in formato Prometheus: span di durata, richieste, errori, dimensioni
+
+Gli span (span('db_query'), span('figure'), ...) finiscono in un istogramma per
+nome; gli hook Flask registrano durata, stato e byte di ogni richiesta. Un
+profiler a campione (cProfile, 1 richiesta ogni PROFILE_EVERY) salva i risultati
+in PROFILE_DIR come file .prof leggibili con pstats o snakeviz; restano solo gli
+ultimi PROFILE_MAX_FILES.
+"""
+import os
+import time
+import bisect
+import cProfile
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+PROFILE_EVERY = int(os.getenv('PROFILE_EVERY', 0))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# File .prof conservati per processo: i più vecchi vengono cancellati
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 50))
+
+HELP = {
+    'dashboard_requests_total': ('counter', 'Richieste HTTP per endpoint e stato'),
+    'dashboard_request_errors_total': ('counter', 'Richieste terminate con errore'),
+    'dashboard_request_duration_seconds': ('histogram', 'Durata delle richieste HTTP'),
+    'dashboard_response_bytes': ('histogram', 'Dimensione del corpo delle risposte'),
+    'dashboard_span_duration_seconds': ('histogram', 'Durata delle fasi interne (DB, pandas, Plotly, JSON)'),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+class Registry:
+    """Contatori e istogrammi con etichette, esportati in formato testo Prometheus"""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            names = sorted({name for name, _ in self._counters} | {name for name, _ in self._histograms})
+            for name in names:
+                kind, text = HELP.get(name, ('untyped', name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(self._counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{{{_labels(labels)}}} {value}")
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        bucket_labels = _labels((*labels, ('le', bound)))
+                        lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+                    lines.append(f"{name}_sum{{{_labels(labels)}}} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{{{_labels(labels)}}} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(name):
+    """Misura la durata di una fase interna (es. 'db_query', 'figure', 'json_encode')"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(
+            'dashboard_span_duration_seconds', (('span', name),), time.perf_counter() - start
+        )
+
+
+def gauges(prefix, stats):
+    """Valori numerici di un dizionario di statistiche come gauge Prometheus"""
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f"# TYPE {prefix}_{key} gauge")
+        lines.append(f"{prefix}_{key} {value}")
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+class SamplingProfiler:
+    """Profila con cProfile una richiesta ogni `every` (0 = disattivato)"""
+
+    def __init__(self, every=PROFILE_EVERY, directory=PROFILE_DIR,
+                 max_files=PROFILE_MAX_FILES):
+        self.every = every
+        self.directory = directory
+        self.max_files = max_files
+        self.dumped = 0
+        self._files = deque()
+        self._requests = 0
+        self._lock = threading.Lock()
+        # cProfile non supporta più profili attivi insieme: uno alla volta
+        self._active = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if not self.every:
+                return None
+            self._requests += 1
+            if self._requests % self.every:
+                return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            self._active.release()
+            return None
+        return profile
+
+    def stop(self, profile, name):
+        try:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(
+                self.directory, f"{name}-{datetime.now():%Y%m%d-%H%M%S-%f}.prof"
+            )
+            profile.dump_stats(path)
+            self.dumped += 1
+            logging.info(f"Profile written to {path}")
+            self._files.append(path)
+            while len(self._files) > self.max_files:
+                os.remove(self._files.popleft())
+        except OSError as e:
+            logging.warning(f"Could not write profile: {e}")
+        finally:
+            self._active.release()
+
+    def stats(self):
+        return {'every': self.every, 'directory': self.directory, 'dumped': self.dumped,
+                'kept': len(self._files), 'max_files': self.max_files}
+
+
+profiler = SamplingProfiler()
+
+
+def init_app(app):
+    """Registra gli hook di misura delle richieste sull'app Flask"""
+    from flask import g, request
+
+    def measured():
+        # Né i file statici né le letture di /metrics finiscono nelle metriche
+        return request.endpoint not in (None, 'static') and request.path != '/metrics'
+
+    @app.before_request
+    def _start_request():
+        if measured():
+            g.metrics_start = time.perf_counter()
+            g.profile = profiler.start()
+
+    @app.after_request
+    def _record_request(response):
+        endpoint = request.endpoint or 'unknown'
+        if 'metrics_start' not in g:
+            return response
+        labels = (('endpoint', endpoint),)
+        registry.observe(
+            'dashboard_request_duration_seconds', labels,
+            time.perf_counter() - g.metrics_start
+        )
+        registry.inc('dashboard_requests_total', (*labels, ('status', response.status_code)))
+        error = response.status_code >= 500
+        if not response.is_streamed and not response.direct_passthrough:
+            body = response.get_data()
+            registry.observe('dashboard_response_bytes', labels, len(body), SIZE_BUCKETS)
+            # Gli handler restituiscono 200 con {"error": ...} quando catturano un'eccezione
+            error = error or b'"error"' in body[:20]
+        if error:
+            registry.inc('dashboard_request_errors_total', labels)
+        return response
+
+    @app.teardown_request
+    def _finish_request(exc):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profiler.stop(profile, request.endpoint or 'unknown')
+        if exc is not None:
+            registry.inc(
+                'dashboard_request_errors_total', (('endpoint', request.endpoint or 'unknown'),)
+            )
@@ -0,0 +1,34 @@
+import os
+import time
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Le query sono I/O bloccante: i thread aspettano MySQL senza tenere il GIL
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('DB_QUERY_WORKERS', os.getenv('DB_POOL_SIZE', 5))),
+    thread_name_prefix='db-query',
+)
+
+
+def _timed(name, func):
+    start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        logging.info(f"Query {name} took {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+def run_parallel(tasks, label='request'):
+    """Esegue in parallelo le funzioni {nome: callable} e ne raccoglie i risultati"""
+    start = time.perf_counter()
+    # Ogni task gira nel contesto del chiamante (es. cache.refreshing)
+    futures = {
+        name: _executor.submit(contextvars.copy_context().run, _timed, name, func)
+        for name, func in tasks.items()
+    }
+    results = {name: future.result() for name, future in futures.items()}
+    logging.info(
+        f"{label}: {len(tasks)} queries in {(time.perf_counter() - start) * 1000:.1f} ms"
+    )
+    return results
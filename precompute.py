@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+import logging
+from cache import cache, refreshing
+
+PRECOMPUTE_ENABLED = os.getenv('PRECOMPUTE_ENABLED', '1') == '1'
+PRECOMPUTE_INTERVAL = float(os.getenv('PRECOMPUTE_INTERVAL', 5))
+# Le viste relative a "adesso" scorrono anche senza dati nuovi: si rigenerano comunque
+PRECOMPUTE_MAX_AGE = float(os.getenv('PRECOMPUTE_MAX_AGE', 60))
+
+
+class Precomputer:
+    """Thread che rigenera le risposte più richieste quando cambiano i dati
+
+    Ogni vista è una funzione che restituisce i byte della risposta; il risultato
+    viene salvato in cache con il token di versione dei dati da cui è stato
+    calcolato, e gli handler lo servono solo se la versione è ancora quella attuale.
+    Le viste leggono dal DB senza passare dalle cache a TTL (cache.refreshing), così
+    il corpo non è mai più vecchio della versione a cui viene associato.
+    """
+
+    def __init__(self, interval=PRECOMPUTE_INTERVAL, max_age=PRECOMPUTE_MAX_AGE):
+        self.interval = interval
+        self.max_age = max_age
+        self.version = lambda: None
+        self.context = None
+        self._views = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'errors': 0, 'served': 0, 'fallbacks': 0,
+                       'last_duration_ms': None}
+
+    def register(self, name, build):
+        self._views[name] = build
+
+    def get(self, name, version):
+        """Byte precalcolati della vista, se calcolati sulla versione indicata"""
+        entry = cache.get(('precomputed', name)) if version else None
+        with self._lock:
+            if entry is not None and entry[0] == version and entry[1] is not None:
+                self._stats['served'] += 1
+                return entry[1]
+            self._stats['fallbacks'] += 1
+        # Dato non pronto: il worker si sveglia subito invece di aspettare il prossimo giro
+        self._wakeup.set()
+        return None
+
+    def _is_current(self, version):
+        """True se tutte le viste sono state calcolate su version da meno di max_age"""
+        now = time.time()
+        for name in self._views:
+            entry = cache.get(('precomputed', name))
+            if entry is None or entry[0] != version or now - entry[2] >= self.max_age:
+                return False
+        return True
+
+    def run_once(self, force=False):
+        """Rigenera tutte le viste se i dati sono cambiati o sono troppo vecchie"""
+        version = self.version()
+        if not version:
+            return False
+        if not force and self._is_current(version):
+            return False
+
+        # Con la cache condivisa un solo processo rigenera le viste per tutti
+        with cache.lock('precompute', blocking=False) as acquired:
+            if not acquired or (not force and self._is_current(version)):
+                return False
+
+            start = time.perf_counter()
+            for name, build in self._views.items():
+                try:
+                    with refreshing():
+                        body = build()
+                except Exception as e:
+                    with self._lock:
+                        self._stats['errors'] += 1
+                    logging.error(f"Precompute of {name} failed: {e}")
+                    continue
+                # Anche "nessun dato" (None) viene salvato, per non ricalcolarlo a ogni giro;
+                # il TTL copre due giri mancati, poi gli handler tornano al calcolo diretto
+                cache.set(('precomputed', name), (version, body, time.time()), self.max_age * 2)
+
+        duration = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['last_duration_ms'] = round(duration, 1)
+        logging.info(f"Precomputed {len(self._views)} views in {duration:.1f} ms")
+        return True
+
+    def start(self):
+        if not PRECOMPUTE_ENABLED or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='precompute', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.context is not None:
+                    with self.context():
+                        self.run_once()
+                else:
+                    self.run_once()
+            except Exception as e:
+                logging.error(f"Precompute worker error: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': PRECOMPUTE_ENABLED,
+                'views': list(self._views),
+                'interval_s': self.interval,
+                **self._stats,
+            }
+
+
+precomputer = Precomputer()
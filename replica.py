@@ -0,0 +1,330 @@
+"""Replica locale SQLite di Storico e Stato per alleggerire il server MySQL
+
+La replica è attiva solo se REPLICA_PATH è impostato. Un thread in background
+copia le righe nuove usando la colonna data come high-water mark; FarmDatabase
+legge dalla replica finché l'ultima sincronizzazione è entro REPLICA_MAX_STALENESS.
+
+Uso: python replica.py sync [--loop 30]
+"""
+import os
+import time
+import sqlite3
+import argparse
+import threading
+import logging
+from datetime import datetime, timedelta
+from metrics import span
+
+REPLICA_PATH = os.getenv('REPLICA_PATH', '')
+SYNC_INTERVAL = float(os.getenv('REPLICA_SYNC_INTERVAL', 30))
+MAX_STALENESS = float(os.getenv('REPLICA_MAX_STALENESS', 120))
+RETENTION_DAYS = float(os.getenv('REPLICA_RETENTION_DAYS', 30))
+SYNC_CHUNK_SIZE = 10000
+
+TABLES = ('Storico', 'Stato')
+EPOCH = datetime(1970, 1, 1)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Storico (
+    parametro TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    valore TEXT,
+    data DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_storico_param_asset_data ON Storico (parametro, asset, data);
+CREATE INDEX IF NOT EXISTS idx_storico_data ON Storico (data);
+CREATE TABLE IF NOT EXISTS Stato (
+    parametro TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    valore TEXT,
+    data DATETIME NOT NULL,
+    PRIMARY KEY (parametro, asset)
+);
+CREATE TABLE IF NOT EXISTS replica_state (
+    name TEXT PRIMARY KEY,
+    value DATETIME NOT NULL
+);
+"""
+
+# Le date sono salvate come testo ISO: il confronto tra stringhe rispetta l'ordine
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+
+
+def _to_sqlite(value):
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return value
+
+
+class ReplicaCursor:
+    """Cursore SQLite con l'interfaccia usata da FarmDatabase (%s, dictionary=True)"""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query, params=()):
+        with span('replica_query'):
+            self._cursor.execute(
+                query.replace('%s', '?'), [_to_sqlite(value) for value in params or ()]
+            )
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def fetchone(self):
+        with span('replica_query'):
+            return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        with span('replica_query'):
+            return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        with span('replica_query'):
+            return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+
+class ReplicaConnection:
+    """Connessione in sola lettura alla replica, compatibile con quelle del pool"""
+
+    is_replica = True
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(
+            path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+        )
+
+    def cursor(self, dictionary=False, **kwargs):
+        return ReplicaCursor(self._conn.cursor(), dictionary)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class Replica:
+    """Replica locale con sincronizzazione incrementale e limite di ritardo"""
+
+    def __init__(self, path=REPLICA_PATH, max_staleness=MAX_STALENESS,
+                 retention_days=RETENTION_DAYS, sync_interval=SYNC_INTERVAL):
+        self.path = path
+        self.max_staleness = max_staleness
+        self.retention = timedelta(days=retention_days)
+        self.sync_interval = sync_interval
+        self._state = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._syncs = 0
+        self._errors = 0
+        self._last_error = None
+        if self.enabled:
+            self._init_store()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _connect(self):
+        # isolation_level=None: le transazioni sono gestite esplicitamente in sync()
+        return sqlite3.connect(
+            self.path, detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None, timeout=30
+        )
+
+    def _init_store(self):
+        conn = self._connect()
+        try:
+            # WAL: le letture della dashboard non si bloccano durante la sincronizzazione
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._state = dict(conn.execute("SELECT name, value FROM replica_state"))
+        finally:
+            conn.close()
+
+    def connect(self):
+        return ReplicaConnection(self.path)
+
+    def staleness(self):
+        """Secondi dall'ultima sincronizzazione riuscita (None se mai sincronizzata)"""
+        synced_at = self._state.get('synced_at')
+        if synced_at is None:
+            return None
+        return (datetime.now() - synced_at).total_seconds()
+
+    def is_fresh(self):
+        if not self.enabled:
+            return False
+        staleness = self.staleness()
+        return staleness is not None and staleness <= self.max_staleness
+
+    def covers(self, start=None):
+        """True se la replica contiene i dati da start in poi"""
+        since = self._state.get('since')
+        if since is None:
+            return False
+        return start is None or start >= since
+
+    def watermarks(self):
+        """Data più recente copiata per tabella, nel formato di get_latest_timestamps"""
+        return {table.lower(): self._state.get(table) for table in TABLES}
+
+    def _copy_rows(self, source, local, table, since):
+        """Copia le righe con data >= since e restituisce (righe, data massima)"""
+        cursor = source.cursor(buffered=False)
+        copied = 0
+        latest = None
+        try:
+            cursor.execute(
+                f"SELECT parametro, asset, valore, data FROM {table} "
+                f"WHERE data >= %s ORDER BY data",
+                (since,)
+            )
+            insert = (
+                "INSERT INTO Storico VALUES (?, ?, ?, ?)" if table == 'Storico'
+                else "INSERT OR REPLACE INTO Stato VALUES (?, ?, ?, ?)"
+            )
+            while True:
+                rows = cursor.fetchmany(SYNC_CHUNK_SIZE)
+                if not rows:
+                    break
+                local.executemany(insert, [
+                    (parametro, asset, valore, _to_sqlite(data))
+                    for parametro, asset, valore, data in rows
+                ])
+                copied += len(rows)
+                latest = rows[-1][3]
+        finally:
+            cursor.close()
+        return copied, latest
+
+    def sync(self, source):
+        """Copia da MySQL le righe nuove di Storico e Stato in un'unica transazione"""
+        with self._lock:
+            now = datetime.now()
+            local = self._connect()
+            try:
+                # BEGIN IMMEDIATE serializza le sincronizzazioni di più processi
+                local.execute("BEGIN IMMEDIATE")
+                state = dict(local.execute("SELECT name, value FROM replica_state"))
+                cutoff = now - self.retention
+                copied = {}
+                for table in TABLES:
+                    # Stato ha una riga per sensore: al primo sync si copia per intero
+                    since = state.get(table) or (cutoff if table == 'Storico' else EPOCH)
+                    if table == 'Storico':
+                        # Le righe con la stessa data dell'ultimo sync possono essere
+                        # arrivate dopo: si ricopiano da quella data compresa
+                        local.execute(
+                            "DELETE FROM Storico WHERE data >= ?", (_to_sqlite(since),)
+                        )
+                    copied[table], latest = self._copy_rows(source, local, table, since)
+                    if latest is not None:
+                        state[table] = latest
+
+                local.execute("DELETE FROM Storico WHERE data < ?", (_to_sqlite(cutoff),))
+                state['since'] = max(state.get('since') or cutoff, cutoff)
+                state['synced_at'] = now
+                local.executemany(
+                    "INSERT OR REPLACE INTO replica_state VALUES (?, ?)",
+                    [(name, _to_sqlite(value)) for name, value in state.items()]
+                )
+                local.execute("COMMIT")
+                self._state = state
+                self._syncs += 1
+                logging.debug(f"Replica synced: {copied}")
+                return copied
+            except Exception:
+                if local.in_transaction:
+                    local.execute("ROLLBACK")
+                raise
+            finally:
+                local.close()
+
+    def start(self):
+        """Avvia il thread di sincronizzazione periodica (una volta per processo)"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='replica-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        from db_pool import get_pool
+
+        while True:
+            try:
+                conn = get_pool().acquire()
+                try:
+                    self.sync(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                self._errors += 1
+                self._last_error = str(e)
+                logging.error(f"Replica sync error: {e}")
+            if self._stop.wait(self.sync_interval):
+                break
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'fresh': self.is_fresh(),
+            'staleness_s': self.staleness(),
+            'max_staleness_s': self.max_staleness,
+            'since': self._state.get('since'),
+            'watermarks': self.watermarks(),
+            'syncs': self._syncs,
+            'errors': self._errors,
+            'last_error': self._last_error,
+        }
+
+
+replica = Replica()
+
+
+if __name__ == '__main__':
+    from db_pool import get_pool
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    sync_parser = sub.add_parser('sync')
+    sync_parser.add_argument('--loop', type=float, default=0,
+                             help='ripete ogni N secondi (0 = una volta)')
+    args = parser.parse_args()
+
+    if not replica.enabled:
+        parser.error("REPLICA_PATH is not set")
+    while True:
+        conn = get_pool().acquire()
+        try:
+            copied = replica.sync(conn)
+            logging.info(f"Replica synced: {copied}")
+        finally:
+            conn.close()
+        if not args.loop:
+            break
+        time.sleep(args.loop)
@@ -0,0 +1,221 @@
+"""Aggregati min/avg/max/count di Storico a 1 minuto, 1 ora e 1 giorno
+
+Uso: python rollups.py create                 # crea le tabelle di rollup
+     python rollups.py backfill --days 365    # ricalcola gli ultimi N giorni
+     python rollups.py update [--loop 60]     # aggiornamento incrementale
+"""
+import argparse
+import time
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+from sensor_history import SENSOR_PARAMETERS, series_filter_sql
+
+# risoluzione -> (tabella, secondi per bucket, formato DATE_FORMAT del bucket)
+RESOLUTIONS = {
+    '1m': ('Storico_1m', 60, '%%Y-%%m-%%d %%H:%%i:00'),
+    '1h': ('Storico_1h', 3600, '%%Y-%%m-%%d %%H:00:00'),
+    '1d': ('Storico_1d', 86400, '%%Y-%%m-%%d 00:00:00'),
+}
+
+STATE_TABLE = 'Storico_rollup_state'
+
+_PARAMS_SQL = ', '.join(f"'{p}'" for p in SENSOR_PARAMETERS)
+
+
+def floor_time(ts, seconds):
+    """Inizio del bucket di ampiezza seconds che contiene ts"""
+    if seconds >= 86400:
+        return datetime(ts.year, ts.month, ts.day)
+    midnight = datetime(ts.year, ts.month, ts.day)
+    offset = int((ts - midnight).total_seconds()) // seconds * seconds
+    return midnight + timedelta(seconds=offset)
+
+
+def choose_resolution(start, end, max_points):
+    """Risoluzione più fine il cui numero di bucket sta nel budget di punti"""
+    span = (end - start).total_seconds()
+    for name, (_, seconds, _) in RESOLUTIONS.items():
+        if span / seconds <= max_points:
+            return name
+    return '1d'
+
+
+def create_tables(conn):
+    cursor = conn.cursor()
+    for table, _, _ in RESOLUTIONS.values():
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            parametro VARCHAR(64) NOT NULL,
+            asset VARCHAR(64) NOT NULL,
+            bucket DATETIME NOT NULL,
+            min_valore DOUBLE NOT NULL,
+            avg_valore DOUBLE NOT NULL,
+            max_valore DOUBLE NOT NULL,
+            n INT NOT NULL,
+            PRIMARY KEY (parametro, asset, bucket)
+        )
+        """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+        resolution VARCHAR(8) PRIMARY KEY,
+        last_data DATETIME NOT NULL
+    )
+    """)
+    cursor.close()
+
+
+def refresh_range(conn, resolution, start, end):
+    """Ricalcola per intero i bucket in [start, end) a partire dai dati grezzi"""
+    table, seconds, fmt = RESOLUTIONS[resolution]
+    start = floor_time(start, seconds)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    INSERT INTO {table} (parametro, asset, bucket, min_valore, avg_valore, max_valore, n)
+    SELECT parametro, asset, DATE_FORMAT(data, '{fmt}') AS bucket,
+           MIN(v), AVG(v), MAX(v), COUNT(*)
+    FROM (
+        SELECT parametro, asset, data, valore + 0 AS v
+        FROM Storico
+        WHERE parametro IN ({_PARAMS_SQL})
+        AND data >= %s AND data < %s
+        AND valore REGEXP '^-?[0-9]+([.][0-9]+)?$'
+    ) AS raw
+    GROUP BY parametro, asset, bucket
+    ON DUPLICATE KEY UPDATE
+        min_valore = VALUES(min_valore),
+        avg_valore = VALUES(avg_valore),
+        max_valore = VALUES(max_valore),
+        n = VALUES(n)
+    """, (start, end))
+    affected = cursor.rowcount
+    cursor.close()
+    return affected
+
+
+def _set_watermark(conn, resolution, last_data):
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    INSERT INTO {STATE_TABLE} (resolution, last_data) VALUES (%s, %s)
+    ON DUPLICATE KEY UPDATE last_data = VALUES(last_data)
+    """, (resolution, last_data))
+    cursor.close()
+
+
+def _get_watermarks(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT resolution, last_data FROM {STATE_TABLE}")
+    watermarks = dict(cursor.fetchall())
+    cursor.close()
+    return watermarks
+
+
+def rollup_coverage(conn, resolution, end):
+    """Fine dei bucket completi (al più end) secondo il watermark, None se mai aggiornati
+
+    Il bucket che contiene last_data può ricevere ancora righe: resta fuori.
+    """
+    _, seconds, _ = RESOLUTIONS[resolution]
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT last_data FROM {STATE_TABLE} WHERE resolution = %s", (resolution,))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None or row[0] is None:
+        return None
+    return min(floor_time(row[0], seconds), end)
+
+
+def _latest_data(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(data) FROM Storico")
+    latest = cursor.fetchone()[0]
+    cursor.close()
+    return latest
+
+
+def backfill(conn, days, chunk=timedelta(days=1)):
+    """Ricalcola gli ultimi N giorni a blocchi, per non tenere lock troppo a lungo"""
+    latest = _latest_data(conn)
+    if latest is None:
+        return
+    start = floor_time(latest - timedelta(days=days), 86400)
+    end = latest + timedelta(seconds=1)
+    for resolution in RESOLUTIONS:
+        cursor_start = start
+        while cursor_start < end:
+            cursor_end = min(cursor_start + chunk, end)
+            refresh_range(conn, resolution, cursor_start, cursor_end)
+            cursor_start = cursor_end
+        _set_watermark(conn, resolution, latest)
+        logging.info(f"Backfilled {resolution} rollups from {start}")
+
+
+def update(conn):
+    """Aggiornamento incrementale: ricalcola solo i bucket toccati dai dati nuovi"""
+    latest = _latest_data(conn)
+    if latest is None:
+        return
+    watermarks = _get_watermarks(conn)
+    for resolution, (_, seconds, _) in RESOLUTIONS.items():
+        last = watermarks.get(resolution)
+        if last is None:
+            logging.warning(f"No {resolution} rollup watermark: run backfill first")
+            last = latest
+        if last >= latest and resolution in watermarks:
+            continue
+        refresh_range(conn, resolution, last, latest + timedelta(seconds=1))
+        _set_watermark(conn, resolution, latest)
+
+
+def read_rollup(conn, resolution, start, end, series=None):
+    """Bucket nell'intervallo come DataFrame compatibile con get_sensor_data"""
+    table, seconds, _ = RESOLUTIONS[resolution]
+    condition, params = series_filter_sql(series)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    SELECT parametro, asset, avg_valore, bucket, min_valore, max_valore, n
+    FROM {table}
+    WHERE {condition}
+    AND bucket >= %s AND bucket < %s
+    ORDER BY bucket DESC
+    """, (*params, floor_time(start, seconds), end))
+    rows = cursor.fetchall()
+    cursor.close()
+    df = pd.DataFrame(
+        rows,
+        columns=['parametro', 'asset', 'valore', 'data', 'min', 'max', 'count'],
+    )
+    df['data'] = pd.to_datetime(df['data'])
+    return df
+
+
+if __name__ == '__main__':
+    from db_pool import get_pool
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('create')
+    backfill_parser = sub.add_parser('backfill')
+    backfill_parser.add_argument('--days', type=int, default=365)
+    update_parser = sub.add_parser('update')
+    update_parser.add_argument('--loop', type=float, default=0,
+                               help='ripete ogni N secondi (0 = una volta)')
+    args = parser.parse_args()
+
+    pool = get_pool()
+    while True:
+        conn = pool.acquire()
+        try:
+            if args.command == 'create':
+                create_tables(conn)
+            elif args.command == 'backfill':
+                create_tables(conn)
+                backfill(conn, args.days)
+            else:
+                update(conn)
+        finally:
+            conn.close()
+        if args.command != 'update' or not args.loop:
+            break
+        time.sleep(args.loop)
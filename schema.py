@@ -0,0 +1,108 @@
+"""Indici richiesti dalle query della dashboard e relativo controllo
+
+Uso: python schema.py            # mostra gli indici mancanti
+     python schema.py --apply    # crea gli indici mancanti
+"""
+import argparse
+import logging
+
+# tabella -> [(nome indice, colonne)]
+REQUIRED_INDEXES = {
+    'Storico': [
+        ('idx_storico_param_asset_data', ('parametro', 'asset', 'data')),
+        ('idx_storico_data', ('data',)),
+    ],
+    'Stato': [
+        ('idx_stato_param_asset', ('parametro', 'asset')),
+    ],
+}
+
+
+def existing_indexes(cursor, table):
+    """Colonne (in ordine) di ogni indice della tabella"""
+    cursor.execute("""
+    SELECT INDEX_NAME, COLUMN_NAME
+    FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    indexes = {}
+    for row in cursor.fetchall():
+        name, column = (row['INDEX_NAME'], row['COLUMN_NAME']) if isinstance(row, dict) else row
+        indexes.setdefault(name, []).append(column)
+    return {name: tuple(columns) for name, columns in indexes.items()}
+
+
+def missing_indexes(cursor):
+    """Indici richiesti non coperti da un indice esistente con lo stesso prefisso"""
+    missing = []
+    for table, required in REQUIRED_INDEXES.items():
+        existing = existing_indexes(cursor, table).values()
+        for name, columns in required:
+            if not any(cols[:len(columns)] == columns for cols in existing):
+                missing.append((table, name, columns))
+    return missing
+
+
+def create_indexes(conn):
+    """Crea gli indici mancanti e restituisce quelli creati"""
+    cursor = conn.cursor()
+    created = []
+    for table, name, columns in missing_indexes(cursor):
+        logging.info(f"Creating index {name} on {table}({', '.join(columns)})")
+        cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+        created.append(name)
+    cursor.close()
+    return created
+
+
+def index_report(cursor, explain_queries=None):
+    """Presenza degli indici e piano EXPLAIN delle query indicate"""
+    report = {'indexes': {}, 'explain': {}}
+    for table, required in REQUIRED_INDEXES.items():
+        existing = existing_indexes(cursor, table).values()
+        for name, columns in required:
+            report['indexes'][name] = any(
+                cols[:len(columns)] == columns for cols in existing
+            )
+
+    for key, (query, params) in (explain_queries or {}).items():
+        try:
+            cursor.execute(f"EXPLAIN {query}", params)
+            plan = cursor.fetchall()
+            report['explain'][key] = [
+                {
+                    'table': row.get('table'),
+                    'type': row.get('type'),
+                    'key': row.get('key'),
+                    'rows': row.get('rows'),
+                    # type=ALL senza chiave = scansione completa della tabella
+                    'full_scan': row.get('type') == 'ALL',
+                }
+                for row in plan
+            ]
+        except Exception as e:
+            logging.warning(f"EXPLAIN failed for {key}: {e}")
+            report['explain'][key] = None
+    return report
+
+
+if __name__ == '__main__':
+    from db_pool import get_pool
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apply', action='store_true', help='crea gli indici mancanti')
+    args = parser.parse_args()
+
+    conn = get_pool().acquire()
+    try:
+        if args.apply:
+            created = create_indexes(conn)
+            print(f"Created {len(created)} index(es): {', '.join(created) or '-'}")
+        else:
+            cursor = conn.cursor()
+            for table, name, columns in missing_indexes(cursor):
+                print(f"Missing: {name} ON {table}({', '.join(columns)})")
+    finally:
+        conn.close()
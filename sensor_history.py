@@ -0,0 +1,128 @@
+import os
+import threading
+import logging
+from datetime import datetime, timedelta
+import pandas as pd
+from metrics import span
+
+SENSOR_PARAMETERS = ('Umidità', 'Temperatura', 'Silos', 'Serbatoio')
+COLUMNS = ['parametro', 'asset', 'valore', 'data']
+
+
+def prepare_sensor_frame(df):
+    """Converte date e valori numerici, scartando le righe non numeriche (OFF)"""
+    df['data'] = pd.to_datetime(df['data'])
+    df['valore'] = pd.to_numeric(df['valore'], errors='coerce')
+    return df.dropna(subset=['valore'])
+
+
+def series_filter_sql(series=None):
+    """Condizione SQL (e parametri) per le serie (parametro, asset) richieste"""
+    if series is None:
+        placeholders = ', '.join(['%s'] * len(SENSOR_PARAMETERS))
+        return f"parametro IN ({placeholders})", list(SENSOR_PARAMETERS)
+    pairs = ', '.join(['(%s, %s)'] * len(series))
+    return f"(parametro, asset) IN ({pairs})", [v for pair in series for v in pair]
+
+
+class SensorHistory:
+    """Finestra mobile in memoria per (parametro, asset) aggiornata in modo incrementale"""
+
+    def __init__(self, window_hours=24):
+        self.window = timedelta(hours=window_hours)
+        self.series = {}
+        self.last_seen = None
+        self._lock = threading.Lock()
+
+    @property
+    def window_hours(self):
+        return self.window.total_seconds() / 3600
+
+    def refresh(self, conn):
+        """Legge solo le righe da last_seen in poi e scarta quelle fuori finestra
+
+        Le righe con la stessa data di last_seen possono essere arrivate dopo l'ultima
+        lettura: si rileggono da quella data compresa, sostituendo quelle già in memoria.
+        """
+        now = datetime.now()
+        with self._lock:
+            since = self.last_seen or now - self.window
+            placeholders = ', '.join(['%s'] * len(SENSOR_PARAMETERS))
+            query = f"""
+            SELECT parametro, asset, valore, data
+            FROM Storico
+            WHERE data >= %s
+            AND parametro IN ({placeholders})
+            ORDER BY data
+            """
+            cursor = conn.cursor()
+            cursor.execute(query, [since, *SENSOR_PARAMETERS])
+            rows = cursor.fetchall()
+            cursor.close()
+
+            if rows:
+                if self.last_seen is not None:
+                    for key, part in list(self.series.items()):
+                        self.series[key] = part.iloc[:part['data'].searchsorted(since)]
+                # Righe ordinate per data: l'ultima è la più recente
+                self.last_seen = max(self.last_seen or since, rows[-1][3])
+                with span('dataframe'):
+                    new = prepare_sensor_frame(pd.DataFrame(rows, columns=COLUMNS))
+                    for key, part in new.groupby(['parametro', 'asset'], sort=False):
+                        part = part[['data', 'valore']]
+                        old = self.series.get(key)
+                        self.series[key] = (
+                            part if old is None
+                            else pd.concat([old, part], ignore_index=True)
+                        )
+            elif self.last_seen is None:
+                self.last_seen = since
+
+            cutoff = now - self.window
+            for key, part in list(self.series.items()):
+                if not part.empty and part['data'].iat[0] < cutoff:
+                    # Le righe sono in ordine di data: basta una ricerca binaria
+                    start = part['data'].searchsorted(cutoff)
+                    self.series[key] = part.iloc[start:].reset_index(drop=True)
+            logging.debug(f"Sensor history refreshed: {len(rows)} new rows")
+
+    def snapshot(self, start, end=None, series=None):
+        """DataFrame delle righe in [start, end), ordinato per data decrescente"""
+        with span('dataframe'):
+            return self._snapshot(start, end, series)
+
+    def _snapshot(self, start, end, series):
+        with self._lock:
+            frames = []
+            for (parametro, asset), part in self.series.items():
+                if series is not None and (parametro, asset) not in series:
+                    continue
+                lo = part['data'].searchsorted(start)
+                hi = len(part) if end is None else part['data'].searchsorted(end)
+                if lo < hi:
+                    frame = part.iloc[lo:hi].copy()
+                    frame['parametro'] = parametro
+                    frame['asset'] = asset
+                    frames.append(frame[COLUMNS])
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS)
+        df = pd.concat(frames, ignore_index=True)
+        return df.sort_values('data', ascending=False, kind='stable', ignore_index=True)
+
+    def since(self, timestamp):
+        """Righe più recenti di timestamp per ogni (parametro, asset)"""
+        with self._lock:
+            new = {}
+            for key, part in self.series.items():
+                start = part['data'].searchsorted(timestamp, side='right')
+                if start < len(part):
+                    new[key] = part.iloc[start:]
+            return new
+
+    def reset(self):
+        with self._lock:
+            self.series = {}
+            self.last_seen = None
+
+
+sensor_history = SensorHistory(window_hours=float(os.getenv('SENSOR_WINDOW_HOURS', 24)))
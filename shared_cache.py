@@ -0,0 +1,214 @@
+"""Cache condivisa tra i processi worker (gunicorn) su file mappati in memoria
+
+Ogni voce è un file nella directory CACHE_SHARED_DIR (meglio se su tmpfs, es.
+/dev/shm/farm-dashboard): intestazione con la scadenza e valore serializzato.
+La scrittura è atomica (file temporaneo + rename) e un lock flock per chiave fa
+sì che un solo processo calcoli un valore mentre gli altri aspettano il risultato.
+Un file .gen per famiglia cambia a ogni invalidate(): chi ha iniziato un calcolo
+prima dell'invalidazione non sovrascrive la voce con il valore vecchio.
+"""
+import os
+import time
+import mmap
+import errno
+import fcntl
+import pickle
+import struct
+import hashlib
+import logging
+from contextlib import contextmanager
+
+CACHE_SHARED_DIR = os.getenv('CACHE_SHARED_DIR', '')
+LOCK_TIMEOUT = float(os.getenv('CACHE_SHARED_LOCK_TIMEOUT', 30))
+SWEEP_EVERY = 100
+LOCK_FILE_MAX_AGE = 86400
+
+_HEADER = struct.Struct('<d')  # scadenza, secondi epoch
+# File di servizio, non voci della cache
+_SPECIAL_SUFFIXES = ('.lock', '.tmp', '.gen')
+
+
+class LockTimeout(Exception):
+    pass
+
+
+def _same_file(fd, path):
+    try:
+        return os.path.samestat(os.fstat(fd), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+class SharedStore:
+    """Archivio chiave -> valore con TTL condiviso da più processi"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        self._sets = 0
+
+    def _file(self, key, suffix=''):
+        family = key[0] if isinstance(key, tuple) else key
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return os.path.join(self.path, f"{family}-{digest}{suffix}")
+
+    def get(self, key):
+        """(valore, secondi rimanenti) oppure None se assente o scaduto"""
+        try:
+            with open(self._file(key), 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    (expires,) = _HEADER.unpack_from(data)
+                    remaining = expires - time.time()
+                    if remaining <= 0:
+                        return None
+                    return pickle.loads(data[_HEADER.size:]), remaining
+        except (FileNotFoundError, ValueError):
+            # ValueError: file vuoto o troncato, trattato come assente
+            return None
+        except Exception as e:
+            logging.warning(f"Shared cache read error: {e}")
+            return None
+
+    def _generation_file(self, family):
+        return os.path.join(self.path, f"{'*' if family is None else family}.gen")
+
+    def _read_generation(self, family):
+        try:
+            with open(self._generation_file(family), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def generation(self, family):
+        """Token delle invalidazioni della famiglia (e dell'intero archivio)"""
+        return self._read_generation(None) + b'|' + self._read_generation(family)
+
+    def _bump_generation(self, family):
+        path = self._generation_file(family)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(f"{os.getpid()}-{time.time_ns()}".encode())
+        os.replace(tmp_path, path)
+
+    def set(self, key, value, ttl, generation=None):
+        """Salva il valore; con generation solo se la famiglia non è stata invalidata"""
+        family = key[0] if isinstance(key, tuple) else key
+        if generation is not None and generation != self.generation(family):
+            return
+        path = self._file(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(time.time() + ttl))
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Shared cache write error: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._sets += 1
+        if self._sets % SWEEP_EVERY == 0:
+            self.sweep()
+
+    @contextmanager
+    def lock(self, key, blocking=True, timeout=LOCK_TIMEOUT):
+        """Lock esclusivo tra processi; con blocking=False restituisce False se occupato"""
+        path = self._file(key, '.lock')
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+        acquired = False
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    # sweep() può aver eliminato il file mentre si aspettava: il lock
+                    # vale solo se il descrittore è ancora quello del percorso
+                    if _same_file(fd, path):
+                        acquired = True
+                        break
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+                    fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+                    continue
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if not blocking:
+                    break
+                if time.monotonic() >= deadline:
+                    raise LockTimeout(f"Shared cache lock timeout for {key[0]}")
+                time.sleep(0.01)
+            if acquired:
+                # flock non aggiorna mtime: sweep() giudica l'età dall'ultimo utilizzo
+                os.utime(fd)
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def invalidate(self, family=None):
+        # Prima la generazione: un calcolo in corso non riscrive le voci eliminate
+        self._bump_generation(family)
+        for name in os.listdir(self.path):
+            if name.endswith(_SPECIAL_SUFFIXES):
+                continue
+            if family is not None and not name.startswith(f"{family}-"):
+                continue
+            try:
+                os.unlink(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def sweep(self):
+        """Elimina le voci scadute e i file di lock inutilizzati da tempo"""
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.endswith(('.tmp', '.gen')):
+                continue
+            if name.endswith('.lock'):
+                removed += self._sweep_lock(path, now)
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    (expires,) = _HEADER.unpack(f.read(_HEADER.size))
+                if expires < now:
+                    os.unlink(path)
+                    removed += 1
+            except (OSError, struct.error):
+                pass
+        return removed
+
+    def _sweep_lock(self, path, now):
+        try:
+            if now - os.path.getmtime(path) < LOCK_FILE_MAX_AGE:
+                return 0
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            return 0
+        try:
+            # Si elimina solo un lock libero: chi lo riapre ne crea uno nuovo
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.unlink(path)
+            return 1
+        except OSError:
+            return 0
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        entries = [name for name in os.listdir(self.path)
+                   if not name.endswith(_SPECIAL_SUFFIXES)]
+        return {
+            'path': self.path,
+            'entries': len(entries),
+            'bytes': sum(
+                os.path.getsize(os.path.join(self.path, name)) for name in entries
+                if os.path.exists(os.path.join(self.path, name))
+            ),
+        }
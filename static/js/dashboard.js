@@ -4,6 +4,19 @@ class FarmDashboard {
     this.retryCount = 0;
     this.maxRetries = 3;
     this.intervalId = null;
+    this.chartLayouts = {};
+    this.etags = {};
+    this.eventSource = null;
+    this.liveConnected = false;
+    this.maxTracePoints = 5000;
+    // Serie inviate dagli aggiornamenti live -> [grafico, nome traccia]
+    this.seriesTraces = {
+      "Umidità_Terreno": ["humidity-chart", "Terreno"],
+      "Umidità_Aria": ["humidity-chart", "Aria"],
+      "Silos_Mangime": ["resources-chart", "Mangime"],
+      "Serbatoio_Acqua": ["resources-chart", "Acqua"],
+      "Temperatura_Aria": ["temperature-chart", "Temperatura"],
+    };
     this.init();
   }
 
@@ -11,6 +24,63 @@ class FarmDashboard {
     this.setupRefreshRateSelector();
     this.loadDashboard();
     this.startAutoUpdate();
+    this.startLiveUpdates();
+  }
+
+  startLiveUpdates() {
+    // Senza stream abilitato sul server resta il polling di startAutoUpdate
+    if (!window.EventSource || document.body.dataset.liveUpdates !== "1") return;
+    this.eventSource = new EventSource("/api/stream");
+    this.eventSource.onopen = () => {
+      this.liveConnected = true;
+    };
+    // Se lo stream cade si torna al polling finché EventSource non si riconnette
+    this.eventSource.onerror = () => {
+      this.liveConnected = false;
+    };
+    this.eventSource.addEventListener("update", (e) => {
+      try {
+        this.applyLiveUpdate(JSON.parse(e.data));
+      } catch (error) {
+        console.error("Error applying live update:", error);
+      }
+    });
+  }
+
+  applyLiveUpdate(update) {
+    if (update.kpis) {
+      this.renderKPIs(update.kpis);
+      this.generateAlerts(update.kpis);
+    }
+    if (update.systems) this.renderSystemStatus(update.systems);
+    if (update.points) this.extendCharts(update.points);
+    this.updateTimestamp();
+  }
+
+  extendCharts(points) {
+    let needsReload = false;
+    Object.entries(points).forEach(([key, series]) => {
+      const target = this.seriesTraces[key];
+      if (!target || series.x.length === 0) return;
+      const [elementId, traceName] = target;
+      const element = document.getElementById(elementId);
+      const index =
+        this.chartLayouts[elementId] && element.data
+          ? element.data.findIndex((trace) => trace.name === traceName)
+          : -1;
+      if (index < 0) {
+        needsReload = true;
+        return;
+      }
+      Plotly.extendTraces(
+        elementId,
+        { x: [series.x], y: [series.y] },
+        [index],
+        this.maxTracePoints
+      );
+    });
+    // Traccia non ancora disegnata (es. grafico vuoto): serve un render completo
+    if (needsReload) this.loadCharts();
   }
 
   setupRefreshRateSelector() {
@@ -45,21 +115,31 @@ class FarmDashboard {
     }
   }
 
+  // Restituisce null se il server risponde 304 (dati invariati dall'ultima richiesta)
   async fetchData(url) {
-    const response = await fetch(url);
+    const headers = {};
+    if (this.etags[url]) headers["If-None-Match"] = this.etags[url];
+    const response = await fetch(url, { headers, cache: "no-store" });
+    if (response.status === 304) {
+      return null;
+    }
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`);
     }
     const data = await response.json();
     if (data.error) {
+      delete this.etags[url];
       throw new Error(data.error);
     }
+    const etag = response.headers.get("ETag");
+    if (etag) this.etags[url] = etag;
     return data;
   }
 
   async loadKPIs() {
     try {
       const kpis = await this.fetchData("/api/kpis");
+      if (kpis === null) return;
       this.renderKPIs(kpis);
       this.generateAlerts(kpis);
     } catch (error) {
@@ -70,7 +150,15 @@ class FarmDashboard {
 
   async loadCharts() {
     try {
-      const charts = await this.fetchData("/api/charts");
+      // Con i layout già disegnati basta chiedere solo i dati delle tracce
+      const chartIds = ["humidity-chart", "resources-chart", "temperature-chart"];
+      const dataOnly = chartIds.every((id) => this.chartLayouts[id]);
+      const charts = await this.fetchData(
+        dataOnly
+          ? "/api/charts?encoding=bdata&data_only=1"
+          : "/api/charts?encoding=bdata"
+      );
+      if (charts === null) return;
       this.renderCharts(charts);
     } catch (error) {
       console.error("Error loading charts:", error);
@@ -81,6 +169,7 @@ class FarmDashboard {
   async loadSystemStatus() {
     try {
       const data = await this.fetchData("/api/system-status");
+      if (data === null) return;
       this.renderSystemStatus(data);
     } catch (error) {
       console.error("Error loading system status:", error);
@@ -215,17 +304,30 @@ class FarmDashboard {
 
     try {
       if (chartData) {
-        const parsedData = JSON.parse(chartData);
-        element.innerHTML = "";
+        const parsedData =
+          typeof chartData === "string" ? JSON.parse(chartData) : chartData;
         const config = { responsive: true, displayModeBar: false };
-        Plotly.newPlot(elementId, parsedData.data, parsedData.layout, config);
+        if (parsedData.layout) {
+          element.innerHTML = "";
+          Plotly.newPlot(elementId, parsedData.data, parsedData.layout, config);
+          // I grafici vuoti non hanno un layout riutilizzabile per i dati
+          if (parsedData.data.length > 0) {
+            this.chartLayouts[elementId] = true;
+          } else {
+            delete this.chartLayouts[elementId];
+          }
+        } else if (this.chartLayouts[elementId]) {
+          Plotly.react(elementId, parsedData.data, element.layout, config);
+        }
       } else {
+        delete this.chartLayouts[elementId];
         element.innerHTML = this.createErrorState(
           `${chartName} non disponibile`
         );
       }
     } catch (error) {
       console.error(`Error rendering ${chartName}:`, error);
+      delete this.chartLayouts[elementId];
       element.innerHTML = this.createErrorState(
         `Errore nel caricamento di ${chartName}`
       );
@@ -272,6 +374,8 @@ class FarmDashboard {
   }
 
   renderError(containerId, message) {
+    // Dopo un errore la prossima richiesta deve ridisegnare tutto
+    this.etags = {};
     const container = document.getElementById(containerId);
     if (container) container.innerHTML = this.createErrorState(message, true);
   }
@@ -279,6 +383,7 @@ class FarmDashboard {
     this.renderError("kpi-container", "Errore nel caricamento dei KPI");
   }
   renderChartErrors() {
+    this.chartLayouts = {};
     ["humidity-chart", "resources-chart", "temperature-chart"].forEach((id) =>
       this.renderError(id, "Errore nel caricamento del grafico")
     );
@@ -313,6 +418,8 @@ class FarmDashboard {
       low: "⚠️ Basso",
       high: "🔥 Alto",
       critical: "🚨 Critico",
+      unstable: "📈 Variazione rapida",
+      stale: "⏸️ Non aggiornato",
     };
     return statuses[status] || "";
   }
@@ -337,10 +444,10 @@ class FarmDashboard {
 
   startAutoUpdate() {
     if (this.intervalId) clearInterval(this.intervalId);
-    this.intervalId = setInterval(
-      () => this.loadDashboard(),
-      this.updateInterval
-    );
+    // Con lo stream live attivo il polling resta fermo
+    this.intervalId = setInterval(() => {
+      if (!this.liveConnected) this.loadDashboard();
+    }, this.updateInterval);
   }
 
   stopAutoUpdate() {
@@ -0,0 +1,209 @@
+import os
+import logging
+import numpy as np
+import pandas as pd
+from sensor_history import series_filter_sql
+from metrics import span
+
+CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 50000))
+
+
+class SensorChunk:
+    """Blocco di righe di Storico in array compatti"""
+
+    __slots__ = ('timestamps', 'values', 'codes', 'keys')
+
+    def __init__(self, timestamps, values, codes, keys):
+        self.timestamps = timestamps  # int64, millisecondi epoch
+        self.values = values          # float32
+        self.codes = codes            # int16, indice in keys
+        self.keys = keys              # lista condivisa di (parametro, asset)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def iter_chunks(conn, start, end, series=None, chunk_size=CHUNK_SIZE):
+    """Legge Storico a blocchi con un cursore non bufferizzato (memoria limitata)
+
+    Le righe restano sul server finché non vengono lette con fetchmany: ogni
+    blocco viene convertito in array tipizzati e le righe Python scartate.
+    """
+    condition, params = series_filter_sql(series)
+    query = f"""
+    SELECT parametro, asset, valore, data
+    FROM Storico
+    WHERE data >= %s AND data < %s
+    AND {condition}
+    ORDER BY data
+    """
+    keys = []
+    key_codes = {}
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(query, [start, end, *params])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            with span('dataframe'):
+                parametri, assets, valori, date = zip(*rows)
+
+                values = pd.to_numeric(pd.Series(valori), errors='coerce').to_numpy(np.float32)
+                valid = ~np.isnan(values)
+                timestamps = np.array(date, dtype='datetime64[ms]').astype(np.int64)
+
+                # Codici locali al blocco rimappati sui codici globali della lettura
+                local_codes, uniques = pd.factorize(pd.MultiIndex.from_arrays([parametri, assets]))
+                mapping = np.empty(len(uniques), dtype=np.int16)
+                for i, key in enumerate(uniques):
+                    code = key_codes.get(key)
+                    if code is None:
+                        code = key_codes[key] = len(keys)
+                        keys.append(key)
+                    mapping[i] = code
+                codes = mapping[local_codes]
+                chunk = SensorChunk(timestamps[valid], values[valid], codes[valid], keys)
+
+            yield chunk
+    finally:
+        cursor.close()
+
+
+def iter_rows(conn, start, end, series=None, chunk_size=CHUNK_SIZE):
+    """Righe di Storico a blocchi così come sono nel DB, per l'esportazione
+
+    A differenza di iter_chunks non converte né scarta nulla: valore resta il testo
+    originale e senza series si leggono tutti i parametri, compreso Stato.
+    """
+    condition, params = series_filter_sql(series) if series is not None else ('1 = 1', [])
+    query = f"""
+    SELECT parametro, asset, valore, data
+    FROM Storico
+    WHERE data >= %s AND data < %s
+    AND {condition}
+    ORDER BY data
+    """
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(query, [start, end, *params])
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+class MinMaxAccumulator:
+    """Downsampling min/max a bucket fissi, alimentato blocco per blocco
+
+    La memoria dipende solo da serie x bucket, non dall'ampiezza dell'intervallo.
+    """
+
+    def __init__(self, start, end, n_buckets):
+        self.start_ms = int(pd.Timestamp(start).value // 1_000_000)
+        self.span_ms = max(int(pd.Timestamp(end).value // 1_000_000) - self.start_ms, 1)
+        self.n_buckets = n_buckets
+        self.keys = []
+        self._state = {}
+
+    def _arrays(self, code):
+        state = self._state.get(code)
+        if state is None:
+            n = self.n_buckets
+            state = {
+                'min': np.full(n, np.inf, dtype=np.float32),
+                'min_ts': np.zeros(n, dtype=np.int64),
+                'max': np.full(n, -np.inf, dtype=np.float32),
+                'max_ts': np.zeros(n, dtype=np.int64),
+            }
+            self._state[code] = state
+        return state
+
+    def add(self, chunk):
+        if not len(chunk):
+            return
+        self.keys = chunk.keys
+        buckets = (chunk.timestamps - self.start_ms) * self.n_buckets // self.span_ms
+        buckets = np.clip(buckets, 0, self.n_buckets - 1)
+        for code in np.unique(chunk.codes):
+            mask = chunk.codes == code
+            b = buckets[mask]
+            v = chunk.values[mask]
+            t = chunk.timestamps[mask]
+            state = self._arrays(int(code))
+
+            # Ordinando per (bucket, valore) il primo e l'ultimo di ogni bucket sono min e max
+            order = np.lexsort((v, b))
+            b, v, t = b[order], v[order], t[order]
+            first = np.r_[True, b[1:] != b[:-1]]
+            last = np.r_[b[1:] != b[:-1], True]
+
+            bf, vf, tf = b[first], v[first], t[first]
+            better = vf < state['min'][bf]
+            state['min'][bf[better]] = vf[better]
+            state['min_ts'][bf[better]] = tf[better]
+
+            bl, vl, tl = b[last], v[last], t[last]
+            better = vl > state['max'][bl]
+            state['max'][bl[better]] = vl[better]
+            state['max_ts'][bl[better]] = tl[better]
+
+    def to_frame(self):
+        """Punti di min e max di ogni bucket, nel formato di get_sensor_data"""
+        frames = []
+        for code, state in self._state.items():
+            filled = np.isfinite(state['min'])
+            ts = np.concatenate((state['min_ts'][filled], state['max_ts'][filled]))
+            values = np.concatenate((state['min'][filled], state['max'][filled]))
+            ts, idx = np.unique(ts, return_index=True)
+            parametro, asset = self.keys[code]
+            frames.append(pd.DataFrame({
+                'parametro': parametro,
+                'asset': asset,
+                # float32 -> float64 senza il rumore delle cifre oltre la precisione
+                'valore': np.round(values[idx].astype(np.float64), 4),
+                'data': ts.astype('datetime64[ms]'),
+            }))
+        if not frames:
+            return pd.DataFrame(columns=['parametro', 'asset', 'valore', 'data'])
+        df = pd.concat(frames, ignore_index=True)
+        return df.sort_values('data', ascending=False, kind='stable', ignore_index=True)
+
+
+def read_downsampled(conn, start, end, series=None, max_points=1000):
+    """Legge un intervallo in streaming riducendolo a circa max_points punti per serie"""
+    accumulator = MinMaxAccumulator(start, end, max(max_points // 2, 1))
+    rows = 0
+    for chunk in iter_chunks(conn, start, end, series):
+        accumulator.add(chunk)
+        rows += len(chunk)
+    logging.debug(f"Streamed {rows} rows into {accumulator.n_buckets} buckets")
+    return accumulator.to_frame()
+
+
+def read_compact(conn, start, end, series=None):
+    """Legge un intervallo completo in streaming, con array compatti e categorie"""
+    timestamps, values, codes = [], [], []
+    keys = []
+    for chunk in iter_chunks(conn, start, end, series):
+        timestamps.append(chunk.timestamps)
+        values.append(chunk.values)
+        codes.append(chunk.codes)
+        keys = chunk.keys
+    if not values:
+        return pd.DataFrame(columns=['parametro', 'asset', 'valore', 'data'])
+    codes = np.concatenate(codes)
+    columns = {}
+    for position, name in enumerate(('parametro', 'asset')):
+        categories = list(dict.fromkeys(key[position] for key in keys))
+        lookup = np.array([categories.index(key[position]) for key in keys], dtype=np.int16)
+        columns[name] = pd.Categorical.from_codes(lookup[codes], categories=categories)
+    df = pd.DataFrame({
+        **columns,
+        'valore': np.concatenate(values),
+        'data': np.concatenate(timestamps).astype('datetime64[ms]'),
+    })
+    return df.iloc[::-1].reset_index(drop=True)